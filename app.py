@@ -10,7 +10,7 @@
 import os
 import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Add project root to path
 sys.path.insert(0, os.path.dirname(__file__))
@@ -20,25 +20,36 @@ from modules.customer_db import (
     record_purchase, get_recent_customers, get_inactive_customers,
     get_birthday_customers, get_anniversary_customers, get_top_customers,
     get_all_active_customers, get_customer_stats, get_customer_by_phone,
-    import_customers_from_csv, export_customers_to_csv
+    get_customers_by_category, import_customers_from_csv, export_customers_to_csv
 )
 from modules.whatsapp_sender import (
-    send_whatsapp_message_instantly, send_bulk_messages,
-    send_personalized_messages, get_message_stats, generate_whatsapp_link
+    send_whatsapp_message_instantly,
+    send_personalized_messages, get_message_stats, generate_whatsapp_link, generate_whatsapp_links,
+    rebuild_message_stats, load_dead_letters, replay_dead_letters,
+    load_opt_outs, add_opt_outs, remove_opt_outs, import_opt_outs
 )
+from modules.send_queue import (
+    send_bulk_campaign, send_personalized_campaign, send_rendered_campaign,
+    interrupted_jobs, run_job_now, enqueue_bulk, enqueue_rendered,
+    scheduled_jobs, cancel_scheduled_job, job_status
+)
+from modules.send_metrics import get_send_metrics_summary
 from modules.festival_manager import (
-    get_today_festivals, get_upcoming_festivals, get_festival_message,
+    get_today_festivals, get_upcoming_festivals,
     get_birthday_message, get_anniversary_message, get_seasonal_sale_message,
     add_festival
 )
 from modules.new_arrivals import (
-    add_product, get_new_arrivals, generate_new_arrival_message,
+    add_product, get_new_arrivals, load_products,
     PRODUCT_CATEGORIES, POPULAR_BRANDS
 )
 from modules.bill_manager import (
     generate_purchase_thankyou, generate_bill_reminder,
     generate_feedback_request, generate_referral_message,
-    get_customer_bill_summary, generate_bill_summary_message
+    get_customer_bill_summary, get_bill_summaries, generate_bill_summary_message,
+    generate_bill_summary_messages, get_revenue_trends, reconcile_payments,
+    get_sales_report, get_pending_loyalty_rewards, generate_pending_loyalty_messages,
+    mark_loyalty_rewards_sent
 )
 from modules.message_templates import (
     welcome_message, shop_info_message, offer_message,
@@ -69,6 +80,12 @@ def print_menu(title, options):
 def pause():
     input("\n  Press Enter to continue...")
 
+def print_campaign_result(results, prefix="\n"):
+    print(f"{prefix}  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']} | ⏸️ Capped: {results['suppressed']}")
+    if results.get('status') == 'scheduled':
+        left = results['total'] - results['cursor']
+        print(f"  🌙 Quiet hours: the other {left} will go out at {results['send_at'][:16]}")
+
 # =============================================
 # MAIN MENU
 # =============================================
@@ -142,6 +159,15 @@ def show_today_alerts():
         for _, c in anniv_customers.iterrows():
             alerts.append(f"  💍 Anniversary: {c['name']} ({c['phone']})")
     
+    # Loyalty rewards waiting to be sent
+    pending_rewards = get_pending_loyalty_rewards()
+    if pending_rewards:
+        alerts.append(f"  🌟 {len(pending_rewards)} loyalty reward(s) to send (Bills menu)")
+    
+    waiting = interrupted_jobs()
+    if waiting:
+        alerts.append(f"  ⏯️  {len(waiting)} campaign(s) waiting to finish (WhatsApp menu)")
+    
     if alerts:
         print(f"\n  {'🔔 TODAY\'S ALERTS':}")
         for a in alerts[:5]:
@@ -281,10 +307,25 @@ def record_purchase_ui():
         return
     
     print(f"  Customer: {customer['name']}")
-    amount = float(input("  Bill amount (₹): ").strip())
+    line_items = []
+    if input("  Add products from catalog? (y/n): ").strip().lower() == 'y':
+        line_items = enter_line_items_ui()
+    
+    if line_items:
+        total = sum(li['qty'] * li['unit_price'] for li in line_items)
+        amount = float(input(f"  Bill amount (₹) [{total:,.0f}]: ").strip() or total)
+    else:
+        amount = float(input("  Bill amount (₹): ").strip())
     items = input("  Items purchased (optional): ").strip()
+    payment_mode = input("  Payment mode (Cash/UPI/Card, or Credit if unpaid) [Cash]: ").strip().title() or 'Cash'
+    is_paid = payment_mode != 'Credit'
+    due_date = ''
+    if not is_paid:
+        default_due = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+        due_date = input(f"  Due date [{default_due}]: ").strip() or default_due
     
-    success, msg = record_purchase(phone, amount, items)
+    success, msg = record_purchase(phone, amount, items, line_items=line_items or None,
+                                   payment_mode=payment_mode, is_paid=is_paid, due_date=due_date)
     
     if success:
         print(f"  ✅ {msg}")
@@ -298,6 +339,23 @@ def record_purchase_ui():
         print(f"  ❌ {msg}")
     pause()
 
+def enter_line_items_ui():
+    """Prompt for product line items until a blank product ID"""
+    products = {p['id']: p for p in load_products()}
+    line_items = []
+    while True:
+        product_id = input("  Product ID (blank to finish): ").strip()
+        if not product_id:
+            break
+        product = products.get(int(product_id))
+        if not product:
+            print("  ❌ No product with that ID")
+            continue
+        qty = float(input(f"  Qty of {product['name']} [1]: ").strip() or 1)
+        price = float(input(f"  Unit price [{product['price']}]: ").strip() or product['price'])
+        line_items.append({'product_id': product['id'], 'qty': qty, 'unit_price': price})
+    return line_items
+
 def import_customers_ui():
     csv_file = input("\n  Enter CSV file path: ").strip()
     if os.path.exists(csv_file):
@@ -341,6 +399,10 @@ def whatsapp_menu():
             ("5", "📤 Send to Inactive Customers"),
             ("6", "🔗 Generate WhatsApp Link"),
             ("7", "📊 Message Stats"),
+            ("8", "📮 Failed Messages (retry)"),
+            ("9", "⏯️  Resume Interrupted Campaigns"),
+            ("S", "⏰ Scheduled Messages"),
+            ("O", "🚫 Opt-outs (do not message)"),
             ("0", "⬅️  Back"),
         ])
         
@@ -360,6 +422,14 @@ def whatsapp_menu():
             wa_link_ui()
         elif choice == '7':
             show_message_stats()
+        elif choice == '8':
+            dead_letters_ui()
+        elif choice == '9':
+            resume_campaigns_ui()
+        elif choice.upper() == 'S':
+            scheduled_ui()
+        elif choice.upper() == 'O':
+            opt_outs_ui()
         elif choice == '0':
             break
 
@@ -392,11 +462,51 @@ def send_all_ui():
         if not message:
             return
     
+    send_at = ask_send_time()
     confirm = input(f"\n  ⚠️ Send to {len(customers)} customers? (yes/no): ").strip().lower()
     if confirm == 'yes':
         phone_list = customers['phone'].tolist()
-        results = send_bulk_messages(phone_list, message)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        if send_at:
+            print_scheduled(enqueue_bulk(phone_list, message, 'Broadcast to all customers', send_at=send_at))
+        else:
+            results = send_bulk_campaign(phone_list, message, 'Broadcast to all customers')
+            print_campaign_result(results)
+    pause()
+
+def ask_send_time():
+    """Ask when to send: None for now, else the chosen datetime"""
+    while True:
+        value = input("  Send when? (Enter = now, or YYYY-MM-DD HH:MM): ").strip()
+        if not value:
+            return None
+        try:
+            send_at = datetime.strptime(value, '%Y-%m-%d %H:%M')
+        except ValueError:
+            print("  ❌ Use the format 2025-10-20 07:00")
+            continue
+        if send_at <= datetime.now():
+            print("  ❌ That time has already passed")
+            continue
+        return send_at
+
+def print_scheduled(job_id):
+    print(f"\n  ⏰ Scheduled for {job_status(job_id)['send_at'][:16]} (job {job_id})")
+    print("  Keep send_worker.py running - it sends the campaign on time.")
+
+def scheduled_ui():
+    jobs = scheduled_jobs()
+    print(f"\n  ⏰ SCHEDULED MESSAGES ({len(jobs)})")
+    print(f"  {'─' * 50}")
+    if not jobs:
+        print("  Nothing scheduled.")
+        pause()
+        return
+    for job in jobs:
+        print(f"  {job['id']}  {job['send_at'][:16]}  {job['description'] or job['kind']} ({job['total']} messages)")
+    
+    job_id = input("\n  Job ID to cancel (Enter to go back): ").strip()
+    if job_id:
+        print(f"  {'✅ Cancelled' if cancel_scheduled_job(job_id) else '❌ Not scheduled (already sent?)'}")
     pause()
 
 def send_category_ui():
@@ -420,8 +530,8 @@ def send_category_ui():
     confirm = input(f"\n  Send to {len(filtered)} customers? (yes/no): ").strip().lower()
     if confirm == 'yes':
         phone_list = filtered['phone'].tolist()
-        results = send_bulk_messages(phone_list, message)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        results = send_bulk_campaign(phone_list, message, 'Broadcast to category')
+        print_campaign_result(results)
     pause()
 
 def send_recent_ui():
@@ -439,8 +549,8 @@ def send_recent_ui():
     confirm = input(f"\n  Send to {len(recent)} customers? (yes/no): ").strip().lower()
     if confirm == 'yes':
         phone_list = recent['phone'].tolist()
-        results = send_bulk_messages(phone_list, message)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        results = send_bulk_campaign(phone_list, message, 'Broadcast to recent customers')
+        print_campaign_result(results)
     pause()
 
 def send_inactive_ui():
@@ -476,15 +586,39 @@ _Show this message to avail the offer_
     confirm = input(f"\n  Send to {len(inactive)} customers? (yes/no): ").strip().lower()
     if confirm == 'yes':
         phone_list = inactive['phone'].tolist()
-        results = send_bulk_messages(phone_list, message)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        results = send_bulk_campaign(phone_list, message, 'Broadcast to inactive customers')
+        print_campaign_result(results)
     pause()
 
 def wa_link_ui():
-    phone = input("\n  Enter phone number: ").strip()
-    message = input("  Enter message: ").strip()
-    link = generate_whatsapp_link(phone, message)
-    print(f"\n  🔗 WhatsApp Link:\n  {link}")
+    print("\n  [1] One customer  [2] All customers  [3] Category  [4] Recent customers")
+    ch = input("  Choice: ").strip()
+    if ch not in ('2', '3', '4'):
+        phone = input("\n  Enter phone number: ").strip()
+        message = input("  Enter message: ").strip()
+        link = generate_whatsapp_link(phone, message)
+        print(f"\n  🔗 WhatsApp Link:\n  {link}")
+        pause()
+        return
+    
+    if ch == '2':
+        customers = get_all_active_customers()
+    elif ch == '3':
+        category = input("  Category (General/Regular/VIP/Electrician/Contractor): ").strip() or 'General'
+        customers = get_customers_by_category(category)
+    else:
+        customers = get_recent_customers(30)
+    if customers.empty:
+        print("  No customers in this segment!")
+        pause()
+        return
+    
+    message = input("  Enter message ({name} = customer name): ").strip()
+    output = input("  Export filename [whatsapp_links.csv]: ").strip() or "whatsapp_links.csv"
+    links = generate_whatsapp_links(customers, message)
+    links.to_csv(output, index=False)
+    print(f"\n  ✅ {len(links)} links saved to {output}")
+    print("  💡 The web dashboard shows the same links as a clickable page (🔗 Generate Link).")
     pause()
 
 def show_message_stats():
@@ -495,6 +629,92 @@ def show_message_stats():
     print(f"  Sent:           {stats['sent']}")
     print(f"  Failed:         {stats['failed']}")
     print(f"  Today:          {stats['today']}")
+    
+    perf = get_send_metrics_summary(7)
+    if perf['attempts']:
+        print(f"\n  ⚡ SEND PERFORMANCE (last {perf['days']} days, {perf['attempts']} attempts)")
+        print(f"  {'─' * 50}")
+        print(f"  {'':<12}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for label, key in [('Queue', 'queue_ms'), ('Render', 'render_ms'), ('Transport', 'transport_ms')]:
+            p = perf['latency'][key]
+            print(f"  {label:<12}{p['p50']:>8}ms{p['p95']:>8}ms{p['p99']:>8}ms")
+        if perf['errors']:
+            print("  Errors: " + ", ".join(f"{name} ×{count}" for name, count in perf['errors'].items()))
+        if perf['campaigns']:
+            print(f"\n  Recent campaigns:")
+            for c in perf['campaigns']:
+                print(f"  {c['campaign']:<24} {c['sent']:>4} sent {c['failed']:>3} failed  {c['per_hour']:>7}/hour")
+    pause()
+
+def resume_campaigns_ui():
+    jobs = interrupted_jobs()
+    print(f"\n  ⏯️  INTERRUPTED / WAITING CAMPAIGNS ({len(jobs)})")
+    print(f"  {'─' * 50}")
+    if not jobs:
+        print("  ✅ Nothing to resume.")
+        pause()
+        return
+    for job in jobs:
+        print(f"  {job['id']}  {job['description'] or job['kind']}: "
+              f"{job['cursor']}/{job['total']} done")
+    
+    if input("\n  Resume all now? (yes/no): ").strip().lower() == 'yes':
+        for job in jobs:
+            try:
+                done = run_job_now(job['id'])
+            except FileNotFoundError:
+                continue  # picked up by the send worker meanwhile
+            print(f"  ✅ {done['id']}: Sent {done['sent']} | Failed {done['failed']} | Capped {done['suppressed']}")
+            if done['status'] == 'scheduled':
+                print(f"     🌙 Quiet hours: the rest will go out at {done['send_at'][:16]}")
+    pause()
+
+def opt_outs_ui():
+    opt_outs = load_opt_outs()
+    print(f"\n  🚫 OPT-OUTS ({len(opt_outs)} phones never get messages)")
+    print(f"  {'─' * 50}")
+    for phone, info in sorted(opt_outs.items(), key=lambda kv: kv[1]['added'])[-10:]:
+        print(f"  {phone}  {info['added'][:10]}  {info['reason']}")
+    
+    choice = input("\n  [A] Add  [R] Remove  [I] Import file  (Enter to go back): ").strip().upper()
+    if choice == 'A':
+        phones = input("  Phone numbers (comma separated): ").split(',')
+        reason = input("  Reason (optional): ").strip()
+        print(f"  ✅ {add_opt_outs([p.strip() for p in phones if p.strip()], reason)} phone(s) opted out")
+    elif choice == 'R':
+        phones = input("  Phone numbers (comma separated): ").split(',')
+        print(f"  ✅ {remove_opt_outs([p.strip() for p in phones if p.strip()])} phone(s) removed")
+    elif choice == 'I':
+        path = input("  CSV or text file with phone numbers: ").strip()
+        if not os.path.exists(path):
+            print("  ❌ File not found!")
+        else:
+            print(f"  ✅ {import_opt_outs(path)} phone(s) opted out")
+    pause()
+
+def dead_letters_ui():
+    letters = load_dead_letters()
+    print(f"\n  📮 FAILED MESSAGES ({len(letters)})")
+    print(f"  {'─' * 50}")
+    if not letters:
+        print("  ✅ Nothing waiting - every message was delivered.")
+        pause()
+        return
+    for e in letters[-20:]:
+        kind = 'permanent' if e['permanent'] else f"{e['attempts']} tries"
+        print(f"  [{e['id']}] {e['timestamp'][:16]} {e['phone']} ({e['message_type']}, {kind})")
+        print(f"      {e['error'][:70]}")
+    if len(letters) > 20:
+        print(f"  ... and {len(letters) - 20} older")
+    
+    choice = input("\n  Resend all? (yes / IDs separated by commas / no): ").strip()
+    if choice.lower() == 'yes':
+        results = replay_dead_letters()
+    elif choice and choice.lower() != 'no':
+        results = replay_dead_letters([i.strip() for i in choice.split(',') if i.strip()])
+    else:
+        return
+    print_campaign_result(results)
     pause()
 
 # =============================================
@@ -577,16 +797,19 @@ def send_festival_wishes_ui():
         return
     
     print(f"\n  Will send {festival_name} wishes to {len(customers)} customers")
+    send_at = ask_send_time()
     confirm = input("  Proceed? (yes/no): ").strip().lower()
     
     if confirm == 'yes':
-        messages_to_send = []
-        for _, c in customers.iterrows():
-            msg = get_festival_message(festival_name, c['name'], SHOP_NAME)
-            messages_to_send.append((c['phone'], msg))
-        
-        results = send_personalized_messages(messages_to_send)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        recipients = zip(customers['phone'], customers['name'])
+        params = {'festival': festival_name, 'shop_name': SHOP_NAME}
+        if send_at:
+            print_scheduled(enqueue_rendered(recipients, 'festival', params, f'{festival_name} wishes',
+                                             message_type='festival', send_at=send_at))
+        else:
+            results = send_rendered_campaign(recipients, 'festival', params, 'Festival wishes',
+                                             message_type='festival')
+            print_campaign_result(results)
     pause()
 
 def send_birthday_wishes_ui():
@@ -722,13 +945,10 @@ def send_arrivals_ui():
     confirm = input("  Proceed? (yes/no): ").strip().lower()
     
     if confirm == 'yes':
-        messages = []
-        for _, c in customers.iterrows():
-            msg = generate_new_arrival_message(arrivals, c['name'], SHOP_NAME)
-            messages.append((c['phone'], msg))
-        
-        results = send_personalized_messages(messages)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        results = send_rendered_campaign(zip(customers['phone'], customers['name']), 'arrivals',
+                                         {'arrivals': arrivals, 'shop_name': SHOP_NAME},
+                                         'New arrivals announcement', message_type='arrivals')
+        print_campaign_result(results)
     pause()
 
 def send_offer_ui():
@@ -751,8 +971,8 @@ def send_offer_ui():
             msg = offer_message(c['name'], offer_text, validity)
             messages.append((c['phone'], msg))
         
-        results = send_personalized_messages(messages)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        results = send_personalized_campaign(messages, 'Special offer', message_type='offer')
+        print_campaign_result(results)
     pause()
 
 # =============================================
@@ -768,6 +988,10 @@ def bill_menu():
             ("3", "📤 Send Customer Summary"),
             ("4", "📤 Request Feedback"),
             ("5", "📤 Send Referral Program"),
+            ("6", "📤 Send Summaries to Regular Customers"),
+            ("7", "💳 Reconcile UPI/Bank Statement"),
+            ("8", "📦 Product Sales Report"),
+            ("9", "🌟 Send Pending Loyalty Rewards"),
             ("0", "⬅️  Back"),
         ])
         
@@ -783,6 +1007,14 @@ def bill_menu():
             feedback_ui()
         elif choice == '5':
             referral_ui()
+        elif choice == '6':
+            bulk_bill_summary_ui()
+        elif choice == '7':
+            reconcile_ui()
+        elif choice == '8':
+            sales_report_ui()
+        elif choice == '9':
+            loyalty_rewards_ui()
         elif choice == '0':
             break
 
@@ -842,6 +1074,97 @@ def bill_summary_ui():
     print(f"  {'✅' if success else '❌'} {result}")
     pause()
 
+def bulk_bill_summary_ui():
+    customers = get_customers_by_category('Regular')
+    if customers.empty:
+        print("\n  No Regular customers!")
+        pause()
+        return
+    
+    summaries = get_bill_summaries(customers['phone'])
+    billed = customers['phone'].isin(summaries.index).sum()
+    if not billed:
+        print("\n  No Regular customers have bills yet!")
+        pause()
+        return
+    
+    print(f"\n  Sending bill summaries to {billed} Regular customers (those with bills)")
+    confirm = input("  Proceed? (yes/no): ").strip().lower()
+    
+    if confirm == 'yes':
+        results = send_personalized_messages(generate_bill_summary_messages(customers, SHOP_NAME, summaries),
+                                             message_type='statement')
+        print_campaign_result(results)
+    pause()
+
+def reconcile_ui():
+    statement_file = input("\n  Statement CSV path: ").strip()
+    if not os.path.exists(statement_file):
+        print("  ❌ File not found!")
+        pause()
+        return
+    
+    window = int(input("  Match payments up to N days after the bill [7]: ").strip() or "7")
+    try:
+        preview = reconcile_payments(statement_file, date_window_days=window, apply=False)
+    except ValueError as e:
+        print(f"  ❌ {e}")
+        pause()
+        return
+    
+    print(f"\n  📄 {preview['lines']} credit lines | ✅ {len(preview['matched'])} matched"
+          f" | ⚠️ {len(preview['ambiguous'])} ambiguous | {preview['unmatched']} unmatched")
+    for m in preview['matched'][:10]:
+        print(f"  ✅ {m['date']} ₹{m['amount']:,.0f} → {m['bill_id']} ({m['customer_name']})")
+    for a in preview['ambiguous'][:10]:
+        print(f"  ⚠️ {a['date']} ₹{a['amount']:,.0f} {a['narration'][:30]} → {', '.join(a['candidates'][:5])}")
+    
+    if preview['matched']:
+        confirm = input(f"\n  Mark {len(preview['matched'])} bills as paid? (yes/no): ").strip().lower()
+        if confirm == 'yes':
+            results = reconcile_payments(statement_file, date_window_days=window)
+            print(f"  ✅ {len(results['matched'])} bills marked paid")
+    pause()
+
+def sales_report_ui():
+    by = input("\n  Group by product / category / brand [product]: ").strip().lower() or "product"
+    if by not in ('product', 'category', 'brand'):
+        print("  ❌ Choose product, category or brand")
+        pause()
+        return
+    start = input("  From date (YYYY-MM-DD, optional): ").strip() or None
+    end = input("  To date (YYYY-MM-DD, optional): ").strip() or None
+    category = input("  Only category (optional): ").strip() or None
+    brand = input("  Only brand (optional): ").strip() or None
+    
+    report = get_sales_report(by, start, end, category=category, brand=brand)
+    if report.empty:
+        print("  No itemised sales in this period.")
+    else:
+        print(f"\n  📦 SALES BY {by.upper()}")
+        print("  " + "-" * 60)
+        for name, row in report.head(20).iterrows():
+            print(f"  {str(name)[:30]:30s} | {row['units']:>6,.0f} units | ₹{row['revenue']:>10,.0f}")
+    pause()
+
+def loyalty_rewards_ui():
+    pending = get_pending_loyalty_rewards()
+    if not pending:
+        print("\n  No pending loyalty rewards!")
+        pause()
+        return
+    
+    print(f"\n  🌟 PENDING LOYALTY REWARDS ({len(pending)})")
+    for r in pending:
+        print(f"  {r['name']:20s} | {r['phone']} | crossed ₹{r['threshold']:,} | {r['reward']}")
+    
+    confirm = input("\n  Send reward messages? (yes/no): ").strip().lower()
+    if confirm == 'yes':
+        results = send_personalized_messages(generate_pending_loyalty_messages(SHOP_NAME), message_type='transactional')
+        mark_loyalty_rewards_sent(d['phone'] for d in results['details'] if d['status'] == 'sent')
+        print_campaign_result(results)
+    pause()
+
 def feedback_ui():
     customers = get_recent_customers(7)
     if customers.empty:
@@ -858,8 +1181,8 @@ def feedback_ui():
             msg = generate_feedback_request(c['name'])
             messages.append((c['phone'], msg))
         
-        results = send_personalized_messages(messages)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        results = send_personalized_campaign(messages, 'Feedback requests', message_type='general')
+        print_campaign_result(results)
     pause()
 
 def referral_ui():
@@ -878,8 +1201,8 @@ def referral_ui():
             msg = generate_referral_message(c['name'])
             messages.append((c['phone'], msg))
         
-        results = send_personalized_messages(messages)
-        print(f"\n  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+        results = send_personalized_campaign(messages, 'Referral program', message_type='offer')
+        print_campaign_result(results)
     pause()
 
 # =============================================
@@ -950,8 +1273,8 @@ def templates_menu():
                 if not customers.empty:
                     confirm = input(f"  Send to {len(customers)} customers? (yes/no): ").strip().lower()
                     if confirm == 'yes':
-                        results = send_bulk_messages(customers['phone'].tolist(), msg)
-                        print(f"  ✅ Sent: {results['sent']} | ❌ Failed: {results['failed']}")
+                        results = send_bulk_campaign(customers['phone'].tolist(), msg, 'Template broadcast')
+                        print_campaign_result(results, prefix="")
         pause()
 
 def choose_template_message():
@@ -991,6 +1314,17 @@ def dashboard():
     print(f"  Total: {c_stats['total_customers']} | Active: {c_stats['active_customers']}")
     print(f"  Revenue: ₹{c_stats['total_revenue']:,.0f} | Avg Purchase: ₹{c_stats['avg_purchase']:,.0f}")
     
+    trends = get_revenue_trends(30)
+    change = trends['mom_change_pct']
+    print(f"\n  📈 REVENUE TRENDS")
+    print(f"  Last 30 days: ₹{trends['period_revenue']:,.0f} ({trends['period_bills']} bills)")
+    print(f"  This month: ₹{trends['this_month']:,.0f} | Last month: ₹{trends['last_month']:,.0f}"
+          f" | Change: {'-' if change is None else f'{change:+.1f}%'}")
+    peak = max(d['amount'] for d in trends['daily']) or 1
+    for d in trends['daily'][-7:]:
+        bar = '█' * int(d['amount'] / peak * 20)
+        print(f"  {d['day'][5:]} {bar} ₹{d['amount']:,.0f}")
+    
     print(f"\n  📱 MESSAGES")
     print(f"  Total Sent: {m_stats['total_messages']} | Today: {m_stats['today']}")
     print(f"  Success: {m_stats['sent']} | Failed: {m_stats['failed']}")
@@ -1030,7 +1364,12 @@ def settings_menu():
   
   📁 Data files are stored in: data/
   📝 Logs are stored in: logs/
+  
+  [R] Rebuild message stats from history
   """)
+    if input("  Choice (Enter to go back): ").strip().lower() == 'r':
+        stats = rebuild_message_stats()
+        print(f"  ✅ Message stats rebuilt: {stats['total']} log entries counted")
     pause()
 
 # =============================================
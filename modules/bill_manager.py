@@ -4,33 +4,348 @@
 # Send bill summaries, payment reminders, and purchase thank you messages
 
 import os
+import re
+import json
+import gzip
+import shutil
+import logging
 import pandas as pd
 from datetime import datetime, timedelta
+from modules.new_arrivals import load_products
+from modules.whatsapp_sender import file_lock
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
-BILLS_FILE = os.path.join(DATA_DIR, 'bills.xlsx')
+BILLS_FILE = os.path.join(DATA_DIR, 'bills.xlsx')  # legacy single-file store (migrated on first use)
+BILLS_DIR = os.path.join(DATA_DIR, 'bills')
+BILLS_MANIFEST = os.path.join(BILLS_DIR, 'manifest.json')
+BILLS_ROLLUP = os.path.join(BILLS_DIR, 'rollup.json')
+BILL_PAYMENTS = os.path.join(BILLS_DIR, 'payments.csv')  # append-only "bill paid" ledger
+BILLS_REJECTED = os.path.join(BILLS_DIR, 'rejected_legacy_bills.csv')  # legacy rows with no usable date
+LOYALTY_TIERS_FILE = os.path.join(DATA_DIR, 'loyalty_tiers.json')  # optional override of LOYALTY_TIERS
+LOYALTY_FILE = os.path.join(DATA_DIR, 'loyalty_rewards.json')
+
+BILL_COLUMNS = [
+    'bill_id', 'customer_phone', 'customer_name', 'amount',
+    'items', 'date', 'is_paid', 'payment_mode', 'due_date',
+    'customer_category'
+]
+# On disk dates are '%Y-%m-%d %H:%M' text; load_bills() returns them as datetime64
+BILL_DATE_FORMAT = '%Y-%m-%d %H:%M'
+# Structured line items (product_id, qty, unit_price) live in their own
+# monthly tables next to the bills: bills/items_YYYY-MM.csv. Each
+# partition's manifest entry lists the product IDs it holds, so product
+# queries skip the months that never sold them.
+LINE_ITEM_COLUMNS = ['bill_id', 'date', 'product_id', 'qty', 'unit_price', 'amount']
+# Read these as text so phones like +919876543210 don't turn into numbers
+BILL_DTYPES = {
+    'bill_id': str, 'customer_phone': str, 'customer_name': str,
+    'items': str, 'date': str, 'payment_mode': str, 'due_date': str,
+    'customer_category': str
+}
 
-def load_bills():
-    """Load bills database"""
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if os.path.exists(BILLS_FILE):
-        return pd.read_excel(BILLS_FILE)
-    return pd.DataFrame(columns=[
-        'bill_id', 'customer_phone', 'customer_name', 'amount',
-        'items', 'date', 'is_paid', 'payment_mode', 'due_date'
-    ])
+# =============================================
+# MONTHLY PARTITION STORAGE
+# =============================================
+# Bills live in one CSV per month (data/bills/bills_YYYY-MM.csv).
+# Past months are "sealed": gzipped, and only ever appended to (as an
+# extra gzip member) when a backdated bill lands in them.
+# manifest.json records each partition's row count and date range,
+# so date-bounded queries only open the months they need, and the
+# number of the next bill ID. Writers hold its lock while appending.
+
+def ensure_bills_dir():
+    os.makedirs(BILLS_DIR, exist_ok=True)
+
+def _empty_bills():
+    return pd.DataFrame(columns=BILL_COLUMNS)
+
+def _partition_file(month, sealed=False, prefix='bills'):
+    return f"{prefix}_{month}.csv.gz" if sealed else f"{prefix}_{month}.csv"
+
+def save_bill_manifest(manifest):
+    """Save the partition manifest (atomic replace)"""
+    ensure_bills_dir()
+    tmp = BILLS_MANIFEST + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, BILLS_MANIFEST)
+
+def load_bill_manifest():
+    """Load the partition manifest, migrating the old bills.xlsx on first use"""
+    ensure_bills_dir()
+    if os.path.exists(BILLS_MANIFEST):
+        with open(BILLS_MANIFEST, 'r', encoding='utf-8') as f:
+            return json.load(f)
 
-def get_recent_bills(phone=None, days=30):
-    """Get recent bills, optionally filtered by customer phone"""
-    df = load_bills()
-    if df.empty:
-        return df
+    if os.path.exists(BILLS_FILE):
+        return migrate_legacy_bills()
+    manifest = {'total_bills': 0, 'next_bill_seq': 1, 'partitions': {}}
+    save_bill_manifest(manifest)
+    return manifest
+
+def _bill_seq(bill_id):
+    """Number of a bill ID (BILL-00042 -> 42); 0 if it has none"""
+    match = re.search(r'(\d+)$', str(bill_id))
+    return int(match.group(1)) if match else 0
+
+def _next_bill_seq(manifest):
+    """Number for the next new bill ID"""
+    if 'next_bill_seq' not in manifest:
+        # Manifests from before the counter: continue after the highest ID on disk
+        ids = list(load_bills()['bill_id'])
+        if os.path.exists(BILLS_REJECTED):
+            ids += list(pd.read_csv(BILLS_REJECTED, dtype=str).get('bill_id', []))
+        manifest['next_bill_seq'] = max((_bill_seq(b) for b in ids), default=0) + 1
+    return manifest['next_bill_seq']
+
+def migrate_legacy_bills():
+    """
+    One-time split of data/bills.xlsx into monthly partitions.
+    
+    The manifest is only saved once every partition is written, so an
+    interrupted migration simply starts over on the next run. Rows whose
+    date can't be read go to rejected_legacy_bills.csv for manual fixing;
+    new bill IDs continue after the highest legacy one, rejected or not.
+    """
+    ensure_bills_dir()
+    for name in os.listdir(BILLS_DIR):  # leftovers of an interrupted migration
+        if name.startswith(('bills_', 'items_')):
+            os.remove(os.path.join(BILLS_DIR, name))
+
+    legacy = pd.read_excel(BILLS_FILE, dtype={'bill_id': str, 'customer_phone': str})
+    manifest = {'total_bills': 0, 'partitions': {},
+                'next_bill_seq': max((_bill_seq(b) for b in legacy.get('bill_id', [])), default=0) + 1}
+    records = []
+    if not legacy.empty:
+        raw_dates = legacy['date']
+        legacy['date'] = pd.to_datetime(raw_dates, errors='coerce')
+        legacy['customer_phone'] = legacy['customer_phone'].apply(
+            lambda x: f'+{x}' if isinstance(x, str) and x.isdigit() else x
+        )
+        rejected = legacy['date'].isna()
+        if rejected.any():
+            legacy[rejected].assign(date=raw_dates[rejected]).to_csv(BILLS_REJECTED, index=False)
+            logging.warning(f"{rejected.sum()} legacy bills have no valid date; "
+                            f"kept in {BILLS_REJECTED}")
+        records = legacy[~rejected].to_dict('records')
+    if records:
+        _append_bills(records, manifest)
+    else:
+        save_bill_manifest(manifest)
+    os.replace(BILLS_FILE, BILLS_FILE + '.migrated')
+    return load_bill_manifest()
+
+def line_items_total(line_items):
+    """Bill amount implied by a list of line items"""
+    return sum(float(li['qty']) * float(li['unit_price']) for li in line_items or [])
+
+def _line_items_frame(records):
+    """Flatten the 'line_items' lists of bill records into one table"""
+    rows = []
+    for r in records:
+        for li in r.get('line_items') or []:
+            rows.append({
+                'bill_id': r['bill_id'],
+                'date': r['date'],
+                'product_id': int(li['product_id']),
+                'qty': float(li['qty']),
+                'unit_price': float(li['unit_price']),
+            })
+    df = pd.DataFrame(rows, columns=LINE_ITEM_COLUMNS)
+    df['amount'] = df['qty'] * df['unit_price']
+    return df
+
+def append_bills(records):
+    """
+    Append bill records to their monthly partitions (batch write).
+    
+    Each record needs a 'date' (datetime, or text that parses as one).
+    A record may carry 'line_items': [{'product_id', 'qty', 'unit_price'}, ...];
+    those go to the month's line-item table, and fill in 'amount' if missing.
+    Backdated bills for a sealed month are appended to its gzip file.
+    Open partitions of past months get sealed afterwards.
+    """
+    if not records:
+        return 0
+    with file_lock(BILLS_MANIFEST):
+        return _append_bills(records, load_bill_manifest())
+
+def _append_bills(records, manifest):
+    """append_bills() for a caller that holds the manifest lock"""
+    records = [dict(r) for r in records]
+    for r in records:
+        if r.get('line_items') and not r.get('amount'):
+            r['amount'] = line_items_total(r['line_items'])
+    df = pd.DataFrame(records).reindex(columns=BILL_COLUMNS)
+    df['date'] = pd.to_datetime(df['date']).dt.strftime(BILL_DATE_FORMAT)
+    df['month'] = df['date'].str[:7]
+    items = _line_items_frame([dict(r, date=d) for r, d in zip(records, df['date'])])
+    items['month'] = items['date'].str[:7]
+
+    for month, chunk in df.groupby('month', sort=True):
+        part = manifest['partitions'].get(month)
+        if part is None:
+            part = {'file': _partition_file(month), 'rows': 0,
+                    'first_date': None, 'last_date': None, 'sealed': False}
+            manifest['partitions'][month] = part
+
+        path = os.path.join(BILLS_DIR, part['file'])
+        chunk = chunk.drop(columns='month')
+        if os.path.exists(path):
+            _upgrade_partition_columns(path)
+        chunk.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+        month_items = items[items['month'] == month].drop(columns='month')
+        if not month_items.empty:
+            part.setdefault('items_file', _partition_file(month, sealed=part['sealed'], prefix='items'))
+            items_path = os.path.join(BILLS_DIR, part['items_file'])
+            month_items.to_csv(items_path, mode='a', header=not os.path.exists(items_path), index=False)
+            if 'products' in part or not part.get('item_rows'):  # older partitions have no index
+                part['products'] = sorted(set(part.get('products', [])) |
+                                          set(month_items['product_id'].astype(int)))
+            part['item_rows'] = part.get('item_rows', 0) + len(month_items)
+
+        dates = chunk['date'].tolist() + [d for d in (part['first_date'], part['last_date']) if d]
+        part['rows'] += len(chunk)
+        part['first_date'] = min(dates)
+        part['last_date'] = max(dates)
+
+    manifest['total_bills'] += len(df)
+    manifest['next_bill_seq'] = max([_next_bill_seq(manifest)] + [_bill_seq(b) + 1 for b in df['bill_id']])
+    save_bill_manifest(manifest)
+    update_bill_rollup(df)
+    seal_bill_partitions()
+    return len(df)
+
+def _upgrade_partition_columns(path):
+    """Rewrite a partition whose header predates new BILL_COLUMNS"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        header = f.readline().strip().split(',')
+    if header != BILL_COLUMNS:
+        df = pd.read_csv(path, dtype=BILL_DTYPES, keep_default_na=False)
+        df.reindex(columns=BILL_COLUMNS, fill_value='').to_csv(path, index=False)
+
+def _gzip_partition(name, dest_name):
+    """Compress a partition file in place; returns the new file name"""
+    src = os.path.join(BILLS_DIR, name)
+    with open(src, 'rb') as f_in, gzip.open(os.path.join(BILLS_DIR, dest_name), 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(src)
+    return dest_name
+
+def seal_bill_partitions(before_month=None):
+    """Gzip and freeze every open partition older than before_month (default: this month)"""
+    before_month = before_month or datetime.now().strftime('%Y-%m')
+    manifest = load_bill_manifest()
+    sealed = 0
+    for month, part in manifest['partitions'].items():
+        if part['sealed'] or month >= before_month:
+            continue
+        part['file'] = _gzip_partition(part['file'], _partition_file(month, sealed=True))
+        if part.get('items_file'):
+            part['items_file'] = _gzip_partition(
+                part['items_file'], _partition_file(month, sealed=True, prefix='items'))
+        part['sealed'] = True
+        sealed += 1
+    if sealed:
+        save_bill_manifest(manifest)
+    return sealed
+
+def add_bill(phone, name, amount, items='', payment_mode='Cash', is_paid=True, due_date='',
+             category='General', line_items=None):
+    """Record a single bill (optionally with structured line items) and return its bill ID"""
+    with file_lock(BILLS_MANIFEST):  # the CLI, web app and send worker all add bills
+        manifest = load_bill_manifest()
+        bill_id = f"BILL-{_next_bill_seq(manifest):05d}"
+        _append_bills([{
+            'bill_id': bill_id,
+            'customer_phone': phone,
+            'customer_name': name,
+            'amount': amount,
+            'items': items,
+            'date': datetime.now(),
+            'is_paid': is_paid,
+            'payment_mode': payment_mode,
+            'due_date': due_date,
+            'customer_category': category,
+            'line_items': line_items
+        }], manifest)
+    return bill_id
+
+def _to_timestamp(value, end_of_day=False):
+    """Parse a bound for date queries; a bare 'YYYY-MM-DD' end covers the whole day"""
+    if value is None:
+        return None
+    ts = pd.Timestamp(value)
+    if end_of_day and isinstance(value, str) and len(value.strip()) == 10:
+        ts = ts + pd.Timedelta(days=1) - pd.Timedelta(minutes=1)
+    return ts
+
+def load_bills(start=None, end=None):
+    """
+    Load bills database, optionally bounded by date.
     
-    cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    Args:
+        start: Earliest date to include ('YYYY-MM-DD' or datetime), or None
+        end: Latest date to include ('YYYY-MM-DD' or datetime), or None
     
+    Only partitions whose months overlap [start, end] are opened.
+    The 'date' column is datetime64 and rows are sorted by it.
+    """
+    manifest = load_bill_manifest()
+    start = _to_timestamp(start)
+    end = _to_timestamp(end, end_of_day=True)
+    start_key = start.strftime(BILL_DATE_FORMAT) if start is not None else None
+    end_key = end.strftime(BILL_DATE_FORMAT) if end is not None else None
+
+    frames = []
+    for month in sorted(manifest['partitions']):
+        part = manifest['partitions'][month]
+        if start_key and part['last_date'] < start_key:
+            continue
+        if end_key and part['first_date'] > end_key:
+            continue
+        frames.append(pd.read_csv(os.path.join(BILLS_DIR, part['file']),
+                                  dtype=BILL_DTYPES, keep_default_na=False)
+                      .reindex(columns=BILL_COLUMNS, fill_value=''))
+
+    if not frames:
+        df = _empty_bills()
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+    df = pd.concat(frames, ignore_index=True)
+    df['date'] = pd.to_datetime(df['date'], format=BILL_DATE_FORMAT)
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
+    df['is_paid'] = df['is_paid'].astype(str).str.lower() == 'true'
+    _apply_payments(df)
+    df = df.sort_values('date', kind='stable', ignore_index=True)
+    return _slice_by_date(df, start, end)
+
+def _slice_by_date(df, start=None, end=None):
+    """Binary-search a date-sorted bills frame for [start, end]"""
+    lo = df['date'].searchsorted(start, side='left') if start is not None else 0
+    hi = df['date'].searchsorted(end, side='right') if end is not None else len(df)
+    return df.iloc[lo:hi].reset_index(drop=True)
+
+def get_bills_between(start, end, phone=None):
+    """Get bills dated between start and end (inclusive), optionally for one customer"""
+    df = load_bills(start=start, end=end)
     if phone:
-        return df[(df['customer_phone'] == phone) & (df['date'] >= cutoff)]
-    return df[df['date'] >= cutoff]
+        return df[df['customer_phone'] == phone]
+    return df
+
+def get_recent_bills(phone=None, days=30):
+    """Get recent bills, optionally filtered by customer phone"""
+    return get_bills_between(datetime.now() - timedelta(days=days), None, phone)
+
+def get_daily_bill_totals(start=None, end=None):
+    """Bill count and amount per calendar day (DataFrame indexed by date)"""
+    df = load_bills(start=start, end=end)
+    return df.groupby(df['date'].dt.normalize()).agg(
+        bills=('bill_id', 'size'),
+        amount=('amount', 'sum'),
+    ).rename_axis('day')
 
 def get_unpaid_bills():
     """Get all unpaid/pending bills"""
@@ -39,26 +354,465 @@ def get_unpaid_bills():
         return df
     return df[df['is_paid'] == False]
 
-def get_customer_bill_summary(phone):
-    """Get bill summary for a customer"""
+# =============================================
+# PRODUCT SALES (from line items)
+# =============================================
+
+def load_line_items(start=None, end=None, product_ids=None):
+    """
+    Load bill line items joined with product name/category/brand.
+    
+    Bounded by date, and optionally limited to some product IDs; months
+    whose product index has none of them are not opened.
+    """
+    manifest = load_bill_manifest()
+    wanted = None if product_ids is None else {int(p) for p in product_ids}
+    start = _to_timestamp(start)
+    end = _to_timestamp(end, end_of_day=True)
+    start_key = start.strftime(BILL_DATE_FORMAT) if start is not None else None
+    end_key = end.strftime(BILL_DATE_FORMAT) if end is not None else None
+
+    frames = []
+    for month in sorted(manifest['partitions']):
+        part = manifest['partitions'][month]
+        if not part.get('items_file'):
+            continue
+        if start_key and part['last_date'] < start_key:
+            continue
+        if end_key and part['first_date'] > end_key:
+            continue
+        if wanted is not None and 'products' in part and wanted.isdisjoint(part['products']):
+            continue
+        frames.append(pd.read_csv(os.path.join(BILLS_DIR, part['items_file']), dtype={'bill_id': str}))
+
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=LINE_ITEM_COLUMNS).astype(
+            {'product_id': int, 'qty': float, 'unit_price': float, 'amount': float})
+    if wanted is not None:
+        df = df[df['product_id'].isin(wanted)]
+    df['date'] = pd.to_datetime(df['date'], format=BILL_DATE_FORMAT)
+    df = df.sort_values('date', kind='stable', ignore_index=True)
+    df = _slice_by_date(df, start, end)
+
+    products = pd.DataFrame(load_products(), columns=['id', 'name', 'category', 'brand'])
+    products = products.rename(columns={'id': 'product_id', 'name': 'product_name'})
+    df = df.merge(products, on='product_id', how='left')
+    df[['product_name', 'category', 'brand']] = df[['product_name', 'category', 'brand']].fillna('Unknown')
+    return df
+
+def get_sales_report(by='product', start=None, end=None, category=None, brand=None):
+    """
+    Units sold and revenue grouped by product, category or brand.
+    
+    Example - Havells fans sold over Diwali week:
+        get_sales_report('product', '2026-10-25', '2026-11-02',
+                         category='Ceiling Fans', brand='Havells')
+    """
+    group_col = {'product': 'product_name', 'category': 'category', 'brand': 'brand'}[by]
+    product_ids = None
+    if category or brand:
+        product_ids = [
+            p['id'] for p in load_products()
+            if (not category or str(p.get('category', '')).lower() == category.lower())
+            and (not brand or str(p.get('brand', '')).lower() == brand.lower())
+        ]
+    df = load_line_items(start, end, product_ids)
+    if category:
+        df = df[df['category'].str.lower() == category.lower()]
+    if brand:
+        df = df[df['brand'].str.lower() == brand.lower()]
+    return df.groupby(group_col).agg(
+        units=('qty', 'sum'),
+        revenue=('amount', 'sum'),
+        bills=('bill_id', 'nunique'),
+    ).sort_values('revenue', ascending=False)
+
+# =============================================
+# PAYMENTS & RECONCILIATION
+# =============================================
+# Sealed partitions are never rewritten, so "bill paid" updates go to
+# payments.csv and are overlaid on the bills when they are loaded.
+
+PAYMENT_COLUMNS = ['bill_id', 'paid_date', 'payment_mode', 'reference']
+
+def load_payments():
+    """Load the bill payments ledger"""
+    if os.path.exists(BILL_PAYMENTS):
+        return pd.read_csv(BILL_PAYMENTS, dtype=str, keep_default_na=False)
+    return pd.DataFrame(columns=PAYMENT_COLUMNS)
+
+def _apply_payments(df):
+    """Mark bills found in the payments ledger as paid (in place)"""
+    payments = load_payments()
+    if payments.empty:
+        return
+    latest = payments.drop_duplicates('bill_id', keep='last').set_index('bill_id')
+    paid = df['bill_id'].isin(latest.index)
+    df.loc[paid, 'is_paid'] = True
+    df.loc[paid, 'payment_mode'] = df.loc[paid, 'bill_id'].map(latest['payment_mode'])
+
+def mark_bills_paid(bill_ids, payment_mode='UPI', references=None, paid_date=None):
+    """Mark many bills as paid in a single ledger write (and move them in the rollup)"""
+    bill_ids = list(bill_ids)
+    if not bill_ids:
+        return 0
+    ensure_bills_dir()
+    bills = load_bills()
+    before = bills[bills['bill_id'].isin(bill_ids)]
+    paid_date = paid_date or datetime.now().strftime(BILL_DATE_FORMAT)
+    references = references or [''] * len(bill_ids)
+    rows = pd.DataFrame({
+        'bill_id': bill_ids,
+        'paid_date': paid_date,
+        'payment_mode': payment_mode,
+        'reference': references,
+    }, columns=PAYMENT_COLUMNS)
+    rows.to_csv(BILL_PAYMENTS, mode='a', header=not os.path.exists(BILL_PAYMENTS), index=False)
+    if os.path.exists(BILLS_ROLLUP) and not before.empty:
+        rollup = load_bill_rollup()
+        _add_to_rollup(rollup, before, sign=-1)
+        _add_to_rollup(rollup, before.assign(payment_mode=payment_mode))
+        save_bill_rollup(rollup)
+    return len(rows)
+
+# Column names seen in UPI app / bank statement exports
+STATEMENT_COLUMNS = {
+    'date': ['date', 'txn date', 'transaction date', 'value date', 'tran date'],
+    'amount': ['amount', 'credit', 'credit amount', 'deposit', 'deposit amt', 'cr amount'],
+    'narration': ['narration', 'description', 'remarks', 'particulars', 'details', 'transaction details'],
+    'reference': ['reference', 'ref no', 'ref no./cheque no.', 'utr', 'upi ref no', 'transaction id'],
+    'type': ['type', 'dr/cr', 'cr/dr', 'transaction type'],
+}
+PHONE_IN_TEXT = re.compile(r'(?<!\d)(?:\+?91)?([6-9]\d{9})(?!\d)')
+
+def load_statement(statement_file):
+    """
+    Read a UPI/bank statement CSV into date, amount, narration, reference.
+    
+    Only credit lines are kept. Dates are read day-first (Indian format).
+    """
+    raw = pd.read_csv(statement_file, dtype=str, keep_default_na=False)
+    raw.columns = [str(c).strip().lower() for c in raw.columns]
+    
+    picked = {}
+    for field, names in STATEMENT_COLUMNS.items():
+        picked[field] = next((n for n in names if n in raw.columns), None)
+    if not picked['date'] or not picked['amount']:
+        raise ValueError("Statement needs a date column and an amount/credit column")
+    
+    amount = pd.to_numeric(raw[picked['amount']].str.replace(',', '').str.replace('₹', ''), errors='coerce')
+    statement = pd.DataFrame({
+        'date': pd.to_datetime(raw[picked['date']], dayfirst=True, errors='coerce'),
+        'amount': amount,
+        'narration': raw[picked['narration']] if picked['narration'] else '',
+        'reference': raw[picked['reference']] if picked['reference'] else '',
+    })
+    if picked['type']:
+        statement = statement[raw[picked['type']].str.upper().str.startswith('C')]
+    return statement[(statement['amount'] > 0) & statement['date'].notna()].reset_index(drop=True)
+
+def _name_tokens(text):
+    return set(re.findall(r'[A-Z]{3,}', str(text).upper()))
+
+def reconcile_payments(statement_file, date_window_days=7, apply=True, payment_mode='UPI'):
+    """
+    Match statement credits against open (unpaid) bills.
+    
+    Bills are hash-indexed by amount (in paise). Each credit line only
+    looks at bills with exactly its amount, dated from 1 day before up to
+    date_window_days after the bill, then confirms by phone number (from
+    the narration / UPI ID) or by customer name.
+    
+    A line with exactly one confirmed bill is a match. Everything else that
+    had amount+date candidates is reported as ambiguous for manual review.
+    All matches are marked paid in one batch write (unless apply=False).
+    
+    Returns:
+        dict with 'matched', 'ambiguous' (lists) and line counts
+    """
+    statement = load_statement(statement_file)
+    open_bills = get_unpaid_bills()
+    
+    index = {}
+    for bill in open_bills.itertuples(index=False):
+        index.setdefault(int(round(bill.amount * 100)), []).append(bill)
+    
+    window_before = pd.Timedelta(days=1)
+    window_after = pd.Timedelta(days=date_window_days)
+    matched = []
+    ambiguous = []
+    used = set()
+    
+    for line in statement.itertuples(index=False):
+        candidates = [
+            b for b in index.get(int(round(line.amount * 100)), [])
+            if b.date - window_before <= line.date <= b.date + window_after and b.bill_id not in used
+        ]
+        if not candidates:
+            continue
+        
+        phones = {'+91' + p for p in PHONE_IN_TEXT.findall(line.narration)}
+        words = _name_tokens(line.narration)
+        scored = []
+        for b in candidates:
+            score = 2 if b.customer_phone in phones else 0
+            name_words = _name_tokens(b.customer_name)
+            if name_words and name_words <= words:
+                score += 1
+            scored.append((score, b))
+        best = max(score for score, _ in scored)
+        top = [b for score, b in scored if score == best]
+        
+        entry = {
+            'date': line.date.strftime('%Y-%m-%d'),
+            'amount': line.amount,
+            'narration': line.narration,
+            'reference': line.reference,
+        }
+        if best > 0 and len(top) == 1:
+            used.add(top[0].bill_id)
+            matched.append({**entry, 'bill_id': top[0].bill_id, 'customer_name': top[0].customer_name,
+                            'customer_phone': top[0].customer_phone})
+        else:
+            ambiguous.append({**entry, 'candidates': [b.bill_id for b in (top if best > 0 else candidates)]})
+    
+    if apply and matched:
+        mark_bills_paid([m['bill_id'] for m in matched], payment_mode=payment_mode,
+                        references=[m['reference'] for m in matched])
+    
+    return {
+        'lines': len(statement),
+        'matched': matched,
+        'ambiguous': ambiguous,
+        'unmatched': len(statement) - len(matched) - len(ambiguous),
+    }
+
+# =============================================
+# REVENUE ROLLUP (for dashboards)
+# =============================================
+# rollup.json keeps bill count & amount per day x customer category x
+# payment mode, plus per-month totals. It is updated as bills are
+# appended and paid, so dashboards never have to scan the bills themselves.
+
+def _empty_rollup():
+    return {'days': {}, 'months': {}}
+
+def load_bill_rollup():
+    """Load the revenue rollup cube (built from the partitions if missing)"""
+    if os.path.exists(BILLS_ROLLUP):
+        with open(BILLS_ROLLUP, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return rebuild_bill_rollup()
+
+def save_bill_rollup(rollup):
+    """Save the revenue rollup cube (atomic replace)"""
+    ensure_bills_dir()
+    tmp = BILLS_ROLLUP + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(rollup, f, ensure_ascii=False)
+    os.replace(tmp, BILLS_ROLLUP)
+
+def _add_to_rollup(rollup, df, sign=1):
+    """Fold a frame of bills into the rollup in place (sign=-1 takes them out)"""
+    category = df['customer_category'].fillna('').astype(str)
+    mode = df['payment_mode'].fillna('').astype(str)
+    df = df.assign(
+        day=df['date'].astype(str).str[:10],
+        category=category.where(category != '', 'Unknown'),
+        mode=mode.where(mode != '', 'Unknown'),
+        amount=pd.to_numeric(df['amount'], errors='coerce').fillna(0),
+    )
+    cells = df.groupby(['day', 'category', 'mode'])['amount'].agg(['size', 'sum'])
+    for (day, category, mode), row in cells.iterrows():
+        modes = rollup['days'].setdefault(day, {}).setdefault(category, {})
+        cell = modes.setdefault(mode, [0, 0.0])
+        cell[0] += sign * int(row['size'])
+        cell[1] += sign * float(row['sum'])
+        if cell[0] <= 0:
+            del modes[mode]
+        month = rollup['months'].setdefault(day[:7], [0, 0.0])
+        month[0] += sign * int(row['size'])
+        month[1] += sign * float(row['sum'])
+
+def update_bill_rollup(df):
+    """Add newly appended bills to the rollup"""
+    if not os.path.exists(BILLS_ROLLUP):
+        rebuild_bill_rollup()  # the partitions already include df
+        return
+    rollup = load_bill_rollup()
+    _add_to_rollup(rollup, df)
+    save_bill_rollup(rollup)
+
+def rebuild_bill_rollup():
+    """Recompute the rollup from every bill partition"""
+    rollup = _empty_rollup()
     df = load_bills()
-    if df.empty:
-        return None
+    if not df.empty:
+        _add_to_rollup(rollup, df)
+    save_bill_rollup(rollup)
+    return rollup
+
+def get_revenue_trends(days=30, today=None):
+    """
+    Revenue trends for dashboards, read from the rollup cube.
     
-    customer_bills = df[df['customer_phone'] == phone]
-    if customer_bills.empty:
-        return None
+    Returns:
+        dict with daily series for the last N days, totals by category and
+        payment mode over that window, and this month vs last month.
+    """
+    rollup = load_bill_rollup()
+    today = (today or datetime.now()).date()
+    
+    daily = []
+    by_category = {}
+    by_mode = {}
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).strftime('%Y-%m-%d')
+        day_bills, day_amount = 0, 0.0
+        for category, modes in rollup['days'].get(day, {}).items():
+            for mode, (count, amount) in modes.items():
+                day_bills += count
+                day_amount += amount
+                by_category[category] = by_category.get(category, 0) + amount
+                by_mode[mode] = by_mode.get(mode, 0) + amount
+        daily.append({'day': day, 'bills': day_bills, 'amount': day_amount})
+    
+    this_month = today.strftime('%Y-%m')
+    last_month = (today.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    this_amount = rollup['months'].get(this_month, [0, 0.0])[1]
+    last_amount = rollup['months'].get(last_month, [0, 0.0])[1]
+    mom_change = round((this_amount - last_amount) / last_amount * 100, 1) if last_amount else None
     
     return {
-        'total_bills': len(customer_bills),
-        'total_amount': customer_bills['amount'].sum(),
-        'avg_bill': customer_bills['amount'].mean(),
-        'last_bill_date': customer_bills['date'].max(),
-        'last_bill_amount': customer_bills.iloc[-1]['amount'],
-        'unpaid_count': len(customer_bills[customer_bills['is_paid'] == False]),
-        'unpaid_amount': customer_bills[customer_bills['is_paid'] == False]['amount'].sum()
+        'daily': daily,
+        'period_revenue': sum(d['amount'] for d in daily),
+        'period_bills': sum(d['bills'] for d in daily),
+        'by_category': by_category,
+        'by_payment_mode': by_mode,
+        'this_month': this_amount,
+        'last_month': last_amount,
+        'mom_change_pct': mom_change,
     }
 
+# =============================================
+# LOYALTY TIERS
+# =============================================
+# record_purchase() calls check_loyalty_tiers() with the customer's
+# total before and after the sale. Only tiers crossed by that sale are
+# considered, so finding reward winners never needs a customer scan.
+
+LOYALTY_TIERS = [
+    {'threshold': 25000, 'reward': '5% OFF on your next purchase'},
+    {'threshold': 50000, 'reward': '10% discount coupon'},
+    {'threshold': 100000, 'reward': 'Free LED lighting kit worth ₹2,000'},
+]
+
+def load_loyalty_tiers():
+    """Tier table, from data/loyalty_tiers.json if present (sorted by threshold)"""
+    tiers = LOYALTY_TIERS
+    if os.path.exists(LOYALTY_TIERS_FILE):
+        with open(LOYALTY_TIERS_FILE, 'r', encoding='utf-8') as f:
+            tiers = json.load(f)
+    return sorted(tiers, key=lambda t: t['threshold'])
+
+def load_loyalty_state():
+    """Rewarded tiers per phone and the queue of reward messages not sent yet"""
+    if os.path.exists(LOYALTY_FILE):
+        with open(LOYALTY_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'rewarded': {}, 'pending': []}
+
+def save_loyalty_state(state):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp = LOYALTY_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, LOYALTY_FILE)
+
+def check_loyalty_tiers(phone, name, old_total, new_total):
+    """
+    Detect loyalty tiers crossed by a single sale.
+    
+    Every newly crossed tier is recorded as rewarded; one reward message
+    (for the highest tier crossed) is queued in the pending list.
+    
+    Returns:
+        list of crossed tier dicts (empty if none)
+    """
+    crossed = [t for t in load_loyalty_tiers() if old_total < t['threshold'] <= new_total]
+    if not crossed:
+        return []
+    
+    state = load_loyalty_state()
+    already = set(state['rewarded'].get(phone, []))
+    crossed = [t for t in crossed if t['threshold'] not in already]
+    if not crossed:
+        return []
+    
+    state['rewarded'][phone] = sorted(already | {t['threshold'] for t in crossed})
+    top = crossed[-1]
+    state['pending'].append({
+        'phone': phone,
+        'name': name,
+        'threshold': top['threshold'],
+        'reward': top['reward'],
+        'total_spent': new_total,
+        'crossed_date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+    })
+    save_loyalty_state(state)
+    return crossed
+
+def get_pending_loyalty_rewards():
+    """Reward messages waiting to be sent"""
+    return load_loyalty_state()['pending']
+
+def generate_pending_loyalty_messages(shop_name="Bhure Electrical"):
+    """Yield (phone, loyalty_reward_message) for every pending reward"""
+    for r in get_pending_loyalty_rewards():
+        yield r['phone'], generate_loyalty_reward_message(r['name'], r['threshold'], r['reward'], shop_name)
+
+def mark_loyalty_rewards_sent(phones):
+    """Drop sent rewards from the pending queue (rewarded tiers are kept)"""
+    phones = set(phones)
+    state = load_loyalty_state()
+    before = len(state['pending'])
+    state['pending'] = [r for r in state['pending'] if r['phone'] not in phones]
+    save_loyalty_state(state)
+    return before - len(state['pending'])
+
+def _summarize_bills(df):
+    """Per-customer bill summary table (one groupby pass, indexed by phone)"""
+    unpaid_amount = df['amount'].where(~df['is_paid'], 0)
+    summary = df.assign(unpaid=~df['is_paid'], unpaid_amount=unpaid_amount).groupby('customer_phone').agg(
+        total_bills=('bill_id', 'size'),
+        total_amount=('amount', 'sum'),
+        avg_bill=('amount', 'mean'),
+        last_bill_date=('date', 'max'),
+        last_bill_amount=('amount', 'last'),
+        unpaid_count=('unpaid', 'sum'),
+        unpaid_amount=('unpaid_amount', 'sum'),
+    )
+    summary['unpaid_count'] = summary['unpaid_count'].astype(int)
+    return summary
+
+def get_bill_summaries(phones=None):
+    """Get bill summaries for many customers at once (DataFrame indexed by phone)"""
+    df = load_bills()
+    if phones is not None:
+        df = df[df['customer_phone'].isin(list(phones))]
+    if df.empty:
+        return _summarize_bills(_empty_bills().astype({'amount': float, 'is_paid': bool}))
+    return _summarize_bills(df)
+
+def get_customer_bill_summary(phone):
+    """Get bill summary for a customer"""
+    summaries = get_bill_summaries([phone])
+    if phone not in summaries.index:
+        return None
+    return summaries.loc[phone].to_dict()
+
 # =============================================
 # MESSAGE GENERATORS
 # =============================================
@@ -111,6 +865,10 @@ def generate_bill_summary_message(customer_name, summary, shop_name="Bhure Elect
     if not summary:
         return None
     
+    last_visit = summary['last_bill_date']
+    if hasattr(last_visit, 'strftime'):
+        last_visit = last_visit.strftime('%d %B %Y')
+    
     unpaid_text = ""
     if summary['unpaid_count'] > 0:
         unpaid_text = f"\n\n⚠️ *Pending Amount: ₹{summary['unpaid_amount']:,.0f}* ({summary['unpaid_count']} bills)"
@@ -123,13 +881,31 @@ Here's your shopping summary with us:
 
 📋 Total Bills: {summary['total_bills']}
 💰 Total Spent: ₹{summary['total_amount']:,.0f}
-📅 Last Visit: {summary['last_bill_date']}{unpaid_text}
+📅 Last Visit: {last_visit}{unpaid_text}
 
 🌟 *You are a valued customer!*
 
 Thank you for choosing {shop_name}! 🙏
 ~ Team {shop_name}"""
 
+def generate_bill_summary_messages(customers, shop_name="Bhure Electrical", summaries=None):
+    """
+    Yield (phone, summary_message) for every customer with billing history.
+    
+    Summaries for all customers come from a single pass over the bills;
+    messages are rendered one at a time as the sender asks for them.
+    
+    Args:
+        customers: DataFrame with 'name' and 'phone' columns
+        summaries: get_bill_summaries() result, if the caller already has it
+    """
+    if customers.empty:
+        return
+    if summaries is None:
+        summaries = get_bill_summaries(customers['phone'])
+    for c in customers[customers['phone'].isin(summaries.index)].itertuples(index=False):
+        yield c.phone, generate_bill_summary_message(c.name, summaries.loc[c.phone].to_dict(), shop_name)
+
 def generate_loyalty_reward_message(customer_name, total_spent, reward, shop_name="Bhure Electrical"):
     """Generate loyalty/reward message for high-value customers"""
     return f"""🌟 *LOYALTY REWARD for You!* 🌟
@@ -8,10 +8,10 @@ import json
 import pandas as pd
 from datetime import datetime, timedelta
 import phonenumbers
+from modules.bill_manager import add_bill, line_items_total, check_loyalty_tiers
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 CUSTOMERS_FILE = os.path.join(DATA_DIR, 'customers.xlsx')
-BILLS_FILE = os.path.join(DATA_DIR, 'bills.xlsx')
 
 def ensure_data_dir():
     """Create data directory if it doesn't exist"""
@@ -123,51 +123,47 @@ def update_customer(phone, **kwargs):
         return True, "Customer updated successfully!"
     return False, "Customer not found!"
 
-def record_purchase(phone, amount, items=''):
-    """Record a purchase for a customer"""
+def record_purchase(phone, amount, items='', line_items=None, payment_mode='Cash',
+                    is_paid=True, due_date=''):
+    """
+    Record a purchase for a customer.
+    
+    line_items: optional [{'product_id', 'qty', 'unit_price'}, ...];
+    if amount is None it is taken from the line items.
+    A credit sale is recorded with is_paid=False and a due_date; it stays
+    open until a payment is applied (see bill_manager.mark_bills_paid).
+    """
     df = load_customers()
     formatted_phone = validate_phone(phone)
+    if amount is None:
+        amount = line_items_total(line_items)
     
     if formatted_phone and formatted_phone in df['phone'].values:
         idx = df[df['phone'] == formatted_phone].index[0]
         df.at[idx, 'total_purchases'] = int(df.at[idx, 'total_purchases'] or 0) + 1
         df.at[idx, 'last_purchase_date'] = datetime.now().strftime('%Y-%m-%d')
         df.at[idx, 'last_purchase_amount'] = amount
-        df.at[idx, 'total_amount_spent'] = float(df.at[idx, 'total_amount_spent'] or 0) + amount
+        old_total = float(df.at[idx, 'total_amount_spent'] or 0)
+        df.at[idx, 'total_amount_spent'] = old_total + amount
         df.at[idx, 'visit_count'] = int(df.at[idx, 'visit_count'] or 0) + 1
         save_customers(df)
         
         # Also record in bills
-        record_bill(formatted_phone, df.at[idx, 'name'], amount, items)
+        record_bill(formatted_phone, df.at[idx, 'name'], amount, items,
+                    payment_mode=payment_mode, is_paid=is_paid, due_date=due_date,
+                    category=df.at[idx, 'category'], line_items=line_items)
+        
+        crossed = check_loyalty_tiers(formatted_phone, df.at[idx, 'name'], old_total, old_total + amount)
+        if crossed:
+            return True, f"Purchase recorded! 🌟 Crossed ₹{crossed[-1]['threshold']:,} loyalty tier - reward queued."
         return True, "Purchase recorded!"
     return False, "Customer not found!"
 
-def record_bill(phone, name, amount, items=''):
-    """Record a bill"""
-    ensure_data_dir()
-    if os.path.exists(BILLS_FILE):
-        bills_df = pd.read_excel(BILLS_FILE)
-    else:
-        bills_df = pd.DataFrame(columns=[
-            'bill_id', 'customer_phone', 'customer_name', 'amount',
-            'items', 'date', 'is_paid', 'payment_mode'
-        ])
-    
-    bill_id = f'BILL-{len(bills_df)+1:05d}'
-    new_bill = {
-        'bill_id': bill_id,
-        'customer_phone': phone,
-        'customer_name': name,
-        'amount': amount,
-        'items': items,
-        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-        'is_paid': True,
-        'payment_mode': 'Cash'
-    }
-    
-    bills_df = pd.concat([bills_df, pd.DataFrame([new_bill])], ignore_index=True)
-    bills_df.to_excel(BILLS_FILE, index=False)
-    return bill_id
+def record_bill(phone, name, amount, items='', payment_mode='Cash', category='General',
+                line_items=None, is_paid=True, due_date=''):
+    """Record a bill (stored in monthly partitions by bill_manager)"""
+    return add_bill(phone, name, amount, items, payment_mode=payment_mode, is_paid=is_paid,
+                    due_date=due_date, category=category, line_items=line_items)
 
 def search_customers(query):
     """Search customers by name or phone"""
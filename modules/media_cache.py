@@ -0,0 +1,117 @@
+# ============================================
+# Bhure Electrical - Media Cache
+# ============================================
+# Product photos straight from a phone camera are 5-10 MB. Before an
+# image is sent it is resized and recompressed once to a WhatsApp-sized
+# JPEG, stored under data/media_cache/ by the hash of the original's
+# content, and that copy is reused for every recipient and campaign.
+# The least recently used files are evicted when the cache gets too big.
+#
+# Needs Pillow (in requirements.txt). Without it, images are sent as
+# they are. Transparent PNGs are flattened onto white, since JPEG has no
+# alpha channel.
+
+import os
+import hashlib
+import logging
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = ImageOps = None
+    PIL_AVAILABLE = False
+
+MEDIA_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'media_cache')
+MEDIA_MAX_DIMENSION = 1600                 # longest side, pixels
+MEDIA_JPEG_QUALITY = 80
+MEDIA_CACHE_MAX_BYTES = 200 * 1024 * 1024  # evict LRU files above this
+
+# (path, size, mtime) -> content hash, so an unchanged file isn't re-read
+_hash_memo = {}
+
+def _content_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _hash_memo:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _hash_memo[key] = digest.hexdigest()
+    return _hash_memo[key]
+
+def _cache_key(path):
+    settings = f'{MEDIA_MAX_DIMENSION}-{MEDIA_JPEG_QUALITY}-white'
+    return hashlib.sha256(f'{_content_hash(path)}:{settings}'.encode()).hexdigest()[:32]
+
+def prepare_image(image_path):
+    """
+    Path of a send-ready copy of image_path (resized JPEG from the cache).
+    Falls back to the original if Pillow is missing or the file can't be read.
+    """
+    if not PIL_AVAILABLE:
+        return image_path
+    try:
+        cached = os.path.join(MEDIA_CACHE_DIR, f'{_cache_key(image_path)}.jpg')
+        if os.path.exists(cached):
+            os.utime(cached)  # mark as recently used
+            return cached
+
+        os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+        tmp = f'{cached}.{os.getpid()}.tmp'
+        try:
+            with Image.open(image_path) as img:
+                img = ImageOps.exif_transpose(img)  # keep phone photos upright
+                img.thumbnail((MEDIA_MAX_DIMENSION, MEDIA_MAX_DIMENSION))
+                _flatten(img).save(tmp, 'JPEG', quality=MEDIA_JPEG_QUALITY, optimize=True)
+            os.replace(tmp, cached)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        logging.info(f"Cached {image_path} ({os.path.getsize(image_path) // 1024} KB) "
+                     f"as {os.path.basename(cached)} ({os.path.getsize(cached) // 1024} KB)")
+        evict_media_cache()
+        return cached
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not prepare image {image_path}, sending original: {str(e)}")
+        return image_path
+
+def _flatten(img):
+    """RGB copy of img; transparent areas become white instead of black"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+def evict_media_cache(max_bytes=MEDIA_CACHE_MAX_BYTES):
+    """Delete least recently used cached images until the cache fits in max_bytes"""
+    if not os.path.isdir(MEDIA_CACHE_DIR):
+        return 0
+    files = []
+    for name in os.listdir(MEDIA_CACHE_DIR):
+        if name.endswith('.jpg'):
+            stat = os.stat(os.path.join(MEDIA_CACHE_DIR, name))
+            files.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(MEDIA_CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+def get_media_cache_stats():
+    """Number of cached images and their total size in bytes"""
+    if not os.path.isdir(MEDIA_CACHE_DIR):
+        return {'files': 0, 'bytes': 0}
+    sizes = [os.path.getsize(os.path.join(MEDIA_CACHE_DIR, n))
+             for n in os.listdir(MEDIA_CACHE_DIR) if n.endswith('.jpg')]
+    return {'files': len(sizes), 'bytes': sum(sizes)}
@@ -0,0 +1,113 @@
+# ============================================
+# Bhure Electrical - Send Metrics
+# ============================================
+# One row per send attempt: how long it waited in the queue, how long
+# the message took to render and to go through the transport, and how
+# it ended. Rows are appended to a CSV per day
+# (logs/metrics/metrics_YYYY-MM-DD.csv), so queries only read the days
+# they need.
+
+import os
+import csv
+import time
+import logging
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+METRICS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs', 'metrics')
+METRIC_COLUMNS = [
+    'ts', 'campaign', 'transport', 'outcome', 'error_class', 'permanent',
+    'attempt', 'queue_ms', 'render_ms', 'transport_ms',
+]
+LATENCY_COLUMNS = ['queue_ms', 'render_ms', 'transport_ms']
+
+def _metrics_file(day):
+    return os.path.join(METRICS_DIR, f'metrics_{day}.csv')
+
+def record_send_metric(outcome, campaign='', transport='', error_class='', permanent=False,
+                       attempt=1, queue_ms=0, render_ms=0, transport_ms=0, ts=None):
+    """Append one send attempt to today's metrics file"""
+    ts = ts or time.time()
+    path = _metrics_file(datetime.fromtimestamp(ts).strftime('%Y-%m-%d'))
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        new_file = not os.path.exists(path)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(METRIC_COLUMNS)
+            writer.writerow([
+                round(ts, 3), campaign or '', transport, outcome, error_class, int(bool(permanent)),
+                attempt, round(queue_ms), round(render_ms), round(transport_ms),
+            ])
+    except OSError as e:
+        logging.warning(f"Could not record send metric: {str(e)}")
+
+def load_send_metrics(days=7, campaign=None):
+    """Metrics rows from the last `days` days (optionally one campaign) as a DataFrame"""
+    start = datetime.now() - timedelta(days=days - 1)
+    frames = []
+    for n in range(days):
+        path = _metrics_file((start + timedelta(days=n)).strftime('%Y-%m-%d'))
+        if os.path.exists(path):
+            frames.append(pd.read_csv(path, dtype={'campaign': str, 'error_class': str}, keep_default_na=False))
+    if not frames:
+        return pd.DataFrame(columns=METRIC_COLUMNS)
+    df = pd.concat(frames, ignore_index=True)
+    if campaign:
+        df = df[df['campaign'] == campaign]
+    return df
+
+def _percentiles(series):
+    if series.empty:
+        return {'p50': 0, 'p95': 0, 'p99': 0}
+    q = series.quantile([0.5, 0.95, 0.99])
+    return {'p50': round(q[0.5]), 'p95': round(q[0.95]), 'p99': round(q[0.99])}
+
+def get_latency_percentiles(days=7, campaign=None):
+    """p50/p95/p99 (milliseconds) of queue, render and transport time for attempts that were sent"""
+    df = load_send_metrics(days, campaign)
+    attempted = df[df['outcome'] != 'suppressed']
+    return {col: _percentiles(attempted[col].astype(float)) for col in LATENCY_COLUMNS}
+
+def get_campaign_throughput(days=7):
+    """
+    Per campaign: attempts, sent, failed, suppressed, first/last send and
+    messages sent per hour over that span. Newest campaigns first.
+    """
+    df = load_send_metrics(days)
+    df = df[df['campaign'] != '']
+    if df.empty:
+        return []
+    rows = []
+    for campaign, g in df.groupby('campaign'):
+        outcomes = g['outcome'].value_counts()
+        span_hours = max((g['ts'].max() - g['ts'].min()) / 3600, 1 / 60)
+        sent = int(outcomes.get('sent', 0))
+        rows.append({
+            'campaign': campaign,
+            'attempts': int((g['outcome'] != 'suppressed').sum()),
+            'sent': sent,
+            'failed': int(outcomes.get('failed', 0)),
+            'suppressed': int(outcomes.get('suppressed', 0)),
+            'first': datetime.fromtimestamp(g['ts'].min()).strftime('%Y-%m-%d %H:%M'),
+            'last': datetime.fromtimestamp(g['ts'].max()).strftime('%Y-%m-%d %H:%M'),
+            'per_hour': round(sent / span_hours, 1),
+        })
+    return sorted(rows, key=lambda r: r['last'], reverse=True)
+
+def get_send_metrics_summary(days=7):
+    """Everything the dashboards show about send performance"""
+    df = load_send_metrics(days)
+    attempted = df[df['outcome'] != 'suppressed']
+    errors = attempted.loc[attempted['outcome'] == 'failed', 'error_class'].value_counts()
+    return {
+        'days': days,
+        'attempts': len(attempted),
+        'sent': int((attempted['outcome'] == 'sent').sum()),
+        'failed': int((attempted['outcome'] == 'failed').sum()),
+        'latency': {col: _percentiles(attempted[col].astype(float)) for col in LATENCY_COLUMNS},
+        'errors': {str(k): int(v) for k, v in errors.items()},
+        'campaigns': get_campaign_throughput(days)[:5],
+    }
@@ -0,0 +1,816 @@
+# ============================================
+# Bhure Electrical - Background Send Queue
+# ============================================
+# Bulk sends take ~10s+ per message, far too long to run inside a web
+# request. The dashboard enqueues a job here and returns its job ID;
+# a separate worker process (python send_worker.py) sends the messages
+# and records progress that the dashboard can poll.
+#
+# The queue is a spool directory:
+#   data/queue/jobs/<job_id>.json   job status/progress (rewritten after every send)
+#   data/queue/jobs/<job_id>.payload  its recipients/messages (written once)
+#   data/queue/pending/<job_id>     marker: waiting for a worker
+#   data/queue/running/<job_id>     marker: claimed by a worker
+#   data/queue/scheduled/<due>-<job_id>  marker: waiting for its send time
+# Claiming is an atomic os.rename of the marker, so several workers
+# can share one queue without sending a job twice. A marker's content
+# is the sender account the job is assigned to (empty = any worker).
+#
+# Job kinds: 'bulk' (one message, many phones), 'personalized' (stored
+# (phone, message) pairs) and 'rendered' (recipients + a renderer name;
+# each message is rendered by the worker just before it is sent).
+#
+# Each job is also a resumable campaign: `cursor` counts recipients that
+# are finished and is saved after every send. If the process dies, the
+# job is requeued and picks up at the cursor instead of starting over.
+#
+# With a pool of sender accounts (see sender_accounts.py), run_pool
+# splits big jobs into one child job per healthy account and runs a
+# worker process per account, so the parts are sent in parallel.
+#
+# Jobs can be scheduled for later (send_at). Their markers are named by
+# due time (YYYYMMDDHHMMSS-<job_id>), so the sorted scheduled/ directory
+# is a persistent min-heap: the worker releases due jobs into pending/
+# and stops at the first one that isn't due. Campaigns are never
+# released during quiet hours; they wait for the morning.
+#
+# Priority lanes: each job runs in a lane by message type (transactional,
+# reminder, marketing). A worker shares its sends between the lanes that
+# have work in proportion to LANE_WEIGHTS, and a running campaign steps
+# aside after its current message when another lane is due, so a
+# thank-you goes out within one send even while a big broadcast drains.
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import multiprocessing
+from datetime import datetime, timedelta
+from functools import partial
+
+from modules.whatsapp_sender import (
+    send_bulk_messages, send_personalized_messages, send_batch_size, iter_message_history,
+    take_dead_letters
+)
+from modules.sender_accounts import (
+    AccountUnhealthy, load_sender_accounts, pool_accounts, activate_account, record_account_result,
+    account_healthy, healthy_accounts
+)
+
+QUEUE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'queue')
+JOBS_DIR = os.path.join(QUEUE_DIR, 'jobs')
+PENDING_DIR = os.path.join(QUEUE_DIR, 'pending')
+RUNNING_DIR = os.path.join(QUEUE_DIR, 'running')
+SCHEDULED_DIR = os.path.join(QUEUE_DIR, 'scheduled')
+
+# A running job whose heartbeat is older than this is assumed to belong
+# to a dead worker and is put back in the queue.
+STALE_JOB_SECONDS = 10 * 60
+
+# Jobs with at least this many recipients left are split across sender accounts
+SHARD_MIN_RECIPIENTS = 20
+
+# No scheduled campaigns go out from 22:00 to 07:00 (local time), except
+# these message types.
+QUIET_HOURS = (22, 7)
+QUIET_HOURS_EXEMPT = {'transactional'}
+
+# Share of sends per lane while several lanes have work (counted in
+# messages). Message types not listed in MESSAGE_LANES are marketing.
+LANE_WEIGHTS = {'transactional': 20, 'reminder': 5, 'marketing': 1}
+MESSAGE_LANES = {'transactional': 'transactional', 'reminder': 'reminder'}
+
+def ensure_queue_dirs():
+    for d in (JOBS_DIR, PENDING_DIR, RUNNING_DIR, SCHEDULED_DIR):
+        os.makedirs(d, exist_ok=True)
+
+def _job_path(job_id):
+    return os.path.join(JOBS_DIR, f'{job_id}.json')
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _payload_path(job_id):
+    return os.path.join(JOBS_DIR, f'{job_id}.payload')
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def save_job(job):
+    """
+    Write a job record (atomic replace, safe to read while the worker
+    updates it). The payload goes to its own file the first time, so
+    the progress saved after every send stays a few hundred bytes.
+    """
+    ensure_queue_dirs()
+    record = dict(job)
+    payload = record.pop('payload', None)
+    if payload is not None and not os.path.exists(_payload_path(job['id'])):
+        _write_json(_payload_path(job['id']), payload)
+    _write_json(_job_path(job['id']), record)
+
+def get_job(job_id, payload=False):
+    """Get a job's status and progress (None if unknown); payload=True also loads its messages"""
+    path = _job_path(job_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        job = json.load(f)
+    if payload and 'payload' not in job:  # jobs saved before the split still carry it inline
+        with open(_payload_path(job_id), 'r', encoding='utf-8') as f:
+            job['payload'] = json.load(f)
+    return job
+
+def root_job(job):
+    """The top-level campaign a job belongs to (shards can be split again)"""
+    seen = {job['id']}
+    while job.get('parent') and job['parent'] not in seen:
+        parent = get_job(job['parent'])
+        if parent is None:
+            break
+        seen.add(parent['id'])
+        job = parent
+    return job
+
+def job_status(job_id):
+    """Job status without the (possibly large) payload, for APIs"""
+    job = get_job(job_id)
+    if job is None:
+        return None
+    job.pop('payload', None)
+    if job.get('children'):
+        # A sharded job: progress is the sum of its parts
+        parts = [p for p in (job_status(c) for c in job['children']) if p]
+        for key in ('sent', 'failed', 'suppressed'):
+            job[key] += sum(p[key] for p in parts)
+        statuses = {p['status'] for p in parts}
+        if statuses <= {'done', 'failed'}:
+            job['status'] = 'failed' if 'failed' in statuses else 'done'
+        else:
+            job['status'] = 'running' if 'running' in statuses else 'queued'
+    done = job['sent'] + job['failed'] + job.get('suppressed', 0)
+    job['progress_pct'] = round(done / job['total'] * 100) if job['total'] else 100
+    return job
+
+def list_jobs(limit=20):
+    """Most recent jobs first (status only)"""
+    ensure_queue_dirs()
+    ids = sorted((f[:-5] for f in os.listdir(JOBS_DIR) if f.endswith('.json')), reverse=True)
+    return [job_status(job_id) for job_id in ids[:limit]]
+
+# =============================================
+# ENQUEUE
+# =============================================
+
+def _write_marker(job_id, account=None, directory=PENDING_DIR):
+    with open(os.path.join(directory, job_id), 'w', encoding='utf-8') as f:
+        f.write(account or '')
+
+def _marker_account(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _enqueue(kind, payload, total, description, delay_seconds, message_type, account=None, parent=None,
+             send_at=None, claimed=False, lane=None):
+    if lane is not None and lane not in LANE_WEIGHTS:
+        raise ValueError(f"Unknown send lane: {lane}")
+    ensure_queue_dirs()
+    job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    if send_at is not None:
+        send_at = _allowed_send_time(send_at, message_type)
+    save_job({
+        'id': job_id,
+        'kind': kind,
+        'description': description,
+        'status': 'scheduled' if send_at else 'queued',
+        'total': total,
+        'sent': 0,
+        'failed': 0,
+        'suppressed': 0,
+        'cursor': 0,
+        'message_type': message_type,
+        'lane': lane or MESSAGE_LANES.get(message_type, 'marketing'),
+        'delay_seconds': delay_seconds,
+        'send_at': send_at.strftime('%Y-%m-%d %H:%M:%S') if send_at else None,
+        'created': _now(),
+        'queued_at': send_at.strftime('%Y-%m-%d %H:%M:%S') if send_at else _now(),
+        'started': None,
+        'finished': None,
+        'heartbeat': None,
+        'worker': None,
+        'account': account,
+        'parent': parent,
+        'error': None,
+        'payload': payload,
+    })
+    if send_at:
+        _write_marker(_schedule_key(send_at, job_id), account, SCHEDULED_DIR)
+        logging.info(f"Scheduled job {job_id} ({kind}, {total} messages) for {send_at:%Y-%m-%d %H:%M}")
+    elif claimed:
+        # The caller runs it right away; no worker ever sees it pending
+        _write_marker(job_id, account, RUNNING_DIR)
+        logging.info(f"Started job {job_id} ({kind}, {total} messages)")
+    else:
+        _write_marker(job_id, account)
+        logging.info(f"Queued job {job_id} ({kind}, {total} messages)")
+    return job_id
+
+def enqueue_bulk(phone_list, message, description='', delay_seconds=10, message_type='general', send_at=None,
+                 claimed=False, lane=None):
+    """
+    Queue the same message to many phones (now, or at the datetime send_at).
+    claimed=True creates it already claimed, for the caller to run_job().
+    lane overrides the priority lane that message_type would give (it
+    does not change caps or quiet hours, which follow message_type).
+    Returns the job ID.
+    """
+    phone_list = list(phone_list)
+    return _enqueue('bulk', {'phones': phone_list, 'message': message},
+                    len(phone_list), description, delay_seconds, message_type, send_at=send_at, claimed=claimed,
+                    lane=lane)
+
+def enqueue_personalized(customer_message_list, description='', delay_seconds=10, message_type='general',
+                         send_at=None, dead_letters=None, claimed=False, lane=None):
+    """
+    Queue [(phone, message), ...] (now, or at the datetime send_at).
+    dead_letters: IDs of the dead letters being resent, one per message;
+    each is removed once its message is sent or fails again.
+    claimed, lane: as for enqueue_bulk. Returns the job ID.
+    """
+    messages = [list(pair) for pair in customer_message_list]
+    payload = {'messages': messages}
+    if dead_letters:
+        payload['dead_letters'] = list(dead_letters)
+    return _enqueue('personalized', payload,
+                    len(messages), description, delay_seconds, message_type, send_at=send_at, claimed=claimed,
+                    lane=lane)
+
+def enqueue_rendered(recipients, renderer, params=None, description='', delay_seconds=10,
+                     message_type='general', send_at=None, claimed=False, lane=None):
+    """
+    Queue [(phone, name), ...] with a renderer from RENDERERS (now, or at
+    the datetime send_at). Only names are stored; each message is
+    rendered just before it is sent. claimed, lane: as for enqueue_bulk.
+    Returns the job ID.
+    """
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown message renderer: {renderer}")
+    recipients = [[str(phone), str(name)] for phone, name in recipients]
+    return _enqueue('rendered', {'recipients': recipients, 'renderer': renderer, 'params': params or {}},
+                    len(recipients), description, delay_seconds, message_type, send_at=send_at,
+                    claimed=claimed, lane=lane)
+
+# =============================================
+# SCHEDULING
+# =============================================
+
+def in_quiet_hours(when):
+    start, end = QUIET_HOURS
+    if start <= end:
+        return start <= when.hour < end
+    return when.hour >= start or when.hour < end
+
+def quiet_hours_end(when):
+    """The first moment after `when` that is outside quiet hours"""
+    if not in_quiet_hours(when):
+        return when
+    end = when.replace(hour=QUIET_HOURS[1], minute=0, second=0, microsecond=0)
+    return end if end > when else end + timedelta(days=1)
+
+def _allowed_send_time(send_at, message_type):
+    """send_at, moved to the end of quiet hours if it falls inside them"""
+    send_at = send_at.replace(microsecond=0)
+    if message_type in QUIET_HOURS_EXEMPT:
+        return send_at
+    return quiet_hours_end(send_at)
+
+def _schedule_key(send_at, job_id):
+    return f"{send_at.strftime('%Y%m%d%H%M%S')}-{job_id}"
+
+def _parse_schedule_key(name):
+    """(due datetime, job ID) from a scheduled marker name"""
+    return datetime.strptime(name[:14], '%Y%m%d%H%M%S'), name[15:]
+
+def release_due_jobs(now=None):
+    """
+    Move scheduled jobs whose time has come into the pending queue.
+    A campaign that comes due during quiet hours (e.g. the worker was
+    off at its send time) is pushed back to the end of quiet hours.
+    Returns the number of jobs released.
+    """
+    ensure_queue_dirs()
+    now = now or datetime.now()
+    released = 0
+    for name in sorted(os.listdir(SCHEDULED_DIR)):
+        due, job_id = _parse_schedule_key(name)
+        if due > now:
+            break  # sorted by due time: nothing after this is due either
+        path = os.path.join(SCHEDULED_DIR, name)
+        job = get_job(job_id)
+        if job is None:
+            os.remove(path)
+            continue
+        if job.get('message_type') not in QUIET_HOURS_EXEMPT and in_quiet_hours(now):
+            later = quiet_hours_end(now)
+            try:
+                os.rename(path, os.path.join(SCHEDULED_DIR, _schedule_key(later, job_id)))
+            except FileNotFoundError:
+                continue  # released or cancelled meanwhile
+            job['send_at'] = later.strftime('%Y-%m-%d %H:%M:%S')
+            save_job(job)
+            logging.info(f"Job {job_id} is due during quiet hours, moved to {later:%Y-%m-%d %H:%M}")
+            continue
+        try:
+            os.rename(path, os.path.join(PENDING_DIR, job_id))
+        except FileNotFoundError:
+            continue  # another worker released it
+        job = get_job(job_id)
+        if job['status'] == 'scheduled':
+            job.update(status='queued', queued_at=job.get('send_at') or _now())  # due since then
+            save_job(job)
+        logging.info(f"Released scheduled job {job_id}")
+        released += 1
+    return released
+
+def scheduled_jobs():
+    """Jobs waiting for their send time, soonest first (status only)"""
+    ensure_queue_dirs()
+    jobs = (job_status(_parse_schedule_key(name)[1]) for name in sorted(os.listdir(SCHEDULED_DIR)))
+    return [job for job in jobs if job]
+
+def cancel_scheduled_job(job_id):
+    """Cancel a job that hasn't been released yet; False if it isn't scheduled"""
+    ensure_queue_dirs()
+    for name in os.listdir(SCHEDULED_DIR):
+        if name[15:] != job_id:
+            continue
+        try:
+            os.remove(os.path.join(SCHEDULED_DIR, name))
+        except FileNotFoundError:
+            return False
+        job = get_job(job_id)
+        job.update(status='cancelled', finished=_now())
+        save_job(job)
+        logging.info(f"Cancelled scheduled job {job_id}")
+        return True
+    return False
+
+# =============================================
+# RENDERERS
+# =============================================
+# name -> function(customer_name, **params) returning the message text
+
+def _render_festival(customer_name, festival, shop_name):
+    from modules.festival_manager import get_festival_message
+    return get_festival_message(festival, customer_name, shop_name)
+
+def _render_arrivals(customer_name, arrivals, shop_name):
+    from modules.new_arrivals import generate_new_arrival_message
+    return generate_new_arrival_message(arrivals, customer_name, shop_name)
+
+RENDERERS = {
+    'festival': _render_festival,
+    'arrivals': _render_arrivals,
+}
+
+def _rendered_messages(payload, start=0):
+    """Lazy (phone, render-callable) pairs from recipient `start` on"""
+    render = RENDERERS[payload['renderer']]
+    for phone, name in payload['recipients'][start:]:
+        yield phone, partial(render, name, **payload['params'])
+
+# =============================================
+# PRIORITY LANES
+# =============================================
+# Start-time fair queuing per worker process: every message sent in a
+# lane advances that lane's virtual time by 1/weight, and the lane with
+# the lowest virtual time goes next. A lane that was idle starts at the
+# current virtual clock, so it gets its share but no backlog of credit.
+
+_lane_vtime = {lane: 0.0 for lane in LANE_WEIGHTS}
+_vclock = 0.0
+_job_lanes = {}  # job ID -> lane, so pending jobs aren't re-read on every check
+
+class JobPreempted(Exception):
+    """A job of a lane that is due first is waiting"""
+    pass
+
+class QuietHoursReached(Exception):
+    """A non-exempt job ran into quiet hours"""
+    pass
+
+def job_lane(job):
+    return job.get('lane') or MESSAGE_LANES.get(job.get('message_type'), 'marketing')
+
+def _pending_lane(job_id):
+    if job_id not in _job_lanes:
+        job = get_job(job_id)
+        _job_lanes[job_id] = job_lane(job) if job else 'marketing'
+    return _job_lanes[job_id]
+
+def _lane_order(lane):
+    """Sort key: the lane with the lowest virtual start time goes next (ties: higher weight)"""
+    return max(_lane_vtime[lane], _vclock), -LANE_WEIGHTS[lane]
+
+def _charge_lane(lane, messages=1):
+    """Account for messages sent in a lane"""
+    global _vclock
+    _vclock = max(_lane_vtime[lane], _vclock)
+    _lane_vtime[lane] = _vclock + messages / LANE_WEIGHTS[lane]
+
+def _claimable_jobs(account=None, assigned_only=False):
+    """Pending job IDs this worker may take, oldest first"""
+    ensure_queue_dirs()
+    pending = sorted(os.listdir(PENDING_DIR))
+    for job_id in set(_job_lanes).difference(pending):
+        del _job_lanes[job_id]  # claimed, cancelled or finished elsewhere
+    jobs = []
+    for job_id in pending:
+        assigned = _marker_account(os.path.join(PENDING_DIR, job_id))
+        if (assigned and assigned != account) or (assigned_only and not assigned):
+            continue
+        jobs.append(job_id)
+    return jobs
+
+def _lane_waiting(lane, account=None, assigned_only=False):
+    """True if a job in a lane that is due before `lane` is waiting for this worker"""
+    return any(_lane_order(_pending_lane(job_id)) < _lane_order(lane)
+               for job_id in _claimable_jobs(account, assigned_only)
+               if _pending_lane(job_id) != lane)
+
+# =============================================
+# WORKER
+# =============================================
+
+def _claim_next_job(account=None, assigned_only=False):
+    """
+    Atomically claim the next pending job for this worker (jobs assigned
+    to `account`, and unassigned ones unless assigned_only): the oldest
+    one in the lane that is due first. Returns its ID or None.
+    """
+    jobs = _claimable_jobs(account, assigned_only)
+    for job_id in sorted(jobs, key=lambda j: _lane_order(_pending_lane(j))):
+        try:
+            os.rename(os.path.join(PENDING_DIR, job_id), os.path.join(RUNNING_DIR, job_id))
+            return job_id
+        except FileNotFoundError:
+            continue  # another worker got it first
+    return None
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def _owner_alive(job):
+    """False if the job's worker process is known to be gone"""
+    host, _, pid = (job.get('worker') or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True  # another machine (or unknown): rely on the heartbeat
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def requeue_stale_jobs(stale_seconds=STALE_JOB_SECONDS):
+    """Put jobs back in the queue if their worker died or stopped sending heartbeats"""
+    ensure_queue_dirs()
+    requeued = 0
+    for job_id in os.listdir(RUNNING_DIR):
+        job = get_job(job_id)
+        beat = (job or {}).get('heartbeat') or (job or {}).get('started')
+        try:
+            # Just claimed, not started yet: the marker's rename time counts
+            last_seen = datetime.strptime(beat, '%Y-%m-%d %H:%M:%S').timestamp() if beat \
+                else os.path.getmtime(os.path.join(RUNNING_DIR, job_id))
+        except FileNotFoundError:
+            continue
+        if job and _owner_alive(job) and time.time() - last_seen < stale_seconds:
+            continue
+        try:
+            os.rename(os.path.join(RUNNING_DIR, job_id), os.path.join(PENDING_DIR, job_id))
+        except FileNotFoundError:
+            continue
+        if job:
+            job.update(status='queued', requeued=True, queued_at=_now())
+            save_job(job)
+        logging.warning(f"Requeued stale job {job_id} at recipient {(job or {}).get('cursor', 0)}")
+        requeued += 1
+    return requeued
+
+def _recipients(job):
+    payload = job['payload']
+    if job['kind'] == 'bulk':
+        return payload['phones']
+    if job['kind'] == 'rendered':
+        return [r[0] for r in payload['recipients']]
+    return [m[0] for m in payload['messages']]
+
+def _sent_since(phone, since):
+    """True if the history shows a message sent to phone at/after `since`"""
+    phone = str(phone).strip()
+    phone = phone if phone.startswith('+') else '+91' + phone.lstrip('0')
+    for entry in iter_message_history(start=since[:10]):
+        if entry.get('phone') == phone and entry.get('status') == 'sent' \
+                and str(entry.get('timestamp', '')) >= since:
+            return True
+    return False
+
+def run_job(job_id, preempt=None):
+    """
+    Send the messages of a claimed job, saving the cursor after each one.
+    A resumed job continues after the last recipient it finished.
+    If preempt(lane) returns True after a message, the job goes back to
+    the queue so that the worker can serve another lane first. A job
+    that is not exempt from quiet hours and runs into them (or is
+    started during them) is put back on the schedule for when they end.
+    """
+    claimed_at = datetime.now()
+    job = get_job(job_id, payload=True)
+    cursor = job.get('cursor', 0)
+    # The recipients in flight when the last run died (one, or a batch
+    # with a batching transport) may have been sent before their progress
+    # was saved; the message history tells us.
+    if job['heartbeat']:
+        recipients = _recipients(job)
+        for _ in range(send_batch_size()):
+            if cursor >= job['total'] or not _sent_since(recipients[cursor], job['heartbeat']):
+                break
+            if job['payload'].get('dead_letters'):
+                take_dead_letters([job['payload']['dead_letters'][cursor]])
+            job['sent'] += 1
+            cursor += 1
+    job.update(status='running', started=job['started'] or _now(), heartbeat=_now(),
+               worker=_worker_id(), cursor=cursor)
+    account = job.get('account')
+    lane = job_lane(job)
+    job.setdefault('suppressed', 0)
+    save_job(job)
+    if cursor:
+        logging.info(f"Resuming job {job_id} at recipient {cursor + 1}/{job['total']}")
+
+    dead_letters = job['payload'].get('dead_letters')
+    quiet = job.get('message_type') not in QUIET_HOURS_EXEMPT
+
+    def on_progress(detail):
+        status = detail['status']
+        if dead_letters and status != 'suppressed':
+            take_dead_letters([dead_letters[job['cursor']]])  # sent, or stored again as a new one
+        job[status if status in ('sent', 'suppressed') else 'failed'] += 1
+        job['cursor'] += 1
+        job['heartbeat'] = _now()
+        save_job(job)
+        if account and record_account_result(account, detail)['unhealthy_until'] > time.time():
+            raise AccountUnhealthy(f"Account {account} is unhealthy")
+        if status != 'suppressed':
+            _charge_lane(lane)
+        if preempt and job['cursor'] < job['total'] and preempt(lane):
+            raise JobPreempted(f"Another lane is due before {lane}")
+        if quiet and job['cursor'] < job['total'] and in_quiet_hours(datetime.now()):
+            raise QuietHoursReached("Quiet hours have started")
+
+    # Queue time is how long this job (or shard) waited to be picked up
+    # since it last became ready, not the pacing of the messages before
+    queued_at = datetime.strptime(job.get('queued_at') or job['created'], '%Y-%m-%d %H:%M:%S')
+    metrics = {'campaign': root_job(job)['id'],
+               'queue_ms': max(0, (claimed_at - queued_at).total_seconds() * 1000)}
+    try:
+        if quiet and job['cursor'] < job['total'] and in_quiet_hours(datetime.now()):
+            raise QuietHoursReached("Started during quiet hours")
+        payload = job['payload']
+        if job['kind'] == 'bulk':
+            send_bulk_messages(payload['phones'][cursor:], payload['message'],
+                               delay_seconds=job['delay_seconds'], on_progress=on_progress,
+                               message_type=job.get('message_type', 'general'), **metrics)
+        elif job['kind'] == 'rendered':
+            send_personalized_messages(_rendered_messages(payload, cursor),
+                                       delay_seconds=job['delay_seconds'], on_progress=on_progress,
+                                       message_type=job.get('message_type', 'general'), **metrics)
+        else:
+            send_personalized_messages([tuple(m) for m in payload['messages'][cursor:]],
+                                       delay_seconds=job['delay_seconds'], on_progress=on_progress,
+                                       message_type=job.get('message_type', 'general'), **metrics)
+        job['status'] = 'done'
+    except AccountUnhealthy as e:
+        # Hand the rest of the job to any other worker (but not back to this
+        # account). Nothing is in flight, so clear the heartbeat as below.
+        logging.warning(f"Job {job_id}: {str(e)}, releasing it at recipient {job['cursor']}")
+        job.update(status='queued', account=None, heartbeat=None, queued_at=_now(),
+                   avoid_accounts=sorted(set(job.get('avoid_accounts', [])) | {account}))
+        save_job(job)
+        _write_marker(job_id, None, RUNNING_DIR)
+        os.rename(os.path.join(RUNNING_DIR, job_id), os.path.join(PENDING_DIR, job_id))
+        return job
+    except JobPreempted:
+        # Nothing is in flight: clear the heartbeat so the resume check
+        # doesn't mistake a later message to the same phone for this one
+        logging.info(f"Job {job_id}: pausing at recipient {job['cursor']} for another lane")
+        job.update(status='queued', heartbeat=None, queued_at=_now())
+        save_job(job)
+        os.rename(os.path.join(RUNNING_DIR, job_id), os.path.join(PENDING_DIR, job_id))
+        return job
+    except QuietHoursReached:
+        later = quiet_hours_end(datetime.now().replace(microsecond=0))
+        logging.info(f"Job {job_id}: quiet hours, pausing at recipient {job['cursor']} "
+                     f"until {later:%Y-%m-%d %H:%M}")
+        job.update(status='scheduled', heartbeat=None, send_at=later.strftime('%Y-%m-%d %H:%M:%S'))
+        save_job(job)
+        os.rename(os.path.join(RUNNING_DIR, job_id),
+                  os.path.join(SCHEDULED_DIR, _schedule_key(later, job_id)))
+        _job_lanes.pop(job_id, None)
+        return job
+    except Exception as e:
+        logging.error(f"Job {job_id} failed: {str(e)}")
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    job['finished'] = _now()
+    save_job(job)
+    os.remove(os.path.join(RUNNING_DIR, job_id))
+    _job_lanes.pop(job_id, None)
+    return job
+
+def run_job_now(job_id):
+    """Claim a specific queued job and run it in this process"""
+    ensure_queue_dirs()
+    os.rename(os.path.join(PENDING_DIR, job_id), os.path.join(RUNNING_DIR, job_id))
+    return run_job(job_id)
+
+def send_bulk_campaign(phone_list, message, description='', delay_seconds=10, message_type='general'):
+    """Send now, as a resumable campaign. Returns the finished job (sent/failed/suppressed counts)."""
+    return run_job(enqueue_bulk(phone_list, message, description, delay_seconds, message_type, claimed=True))
+
+def send_personalized_campaign(customer_message_list, description='', delay_seconds=10, message_type='general'):
+    """Send [(phone, message), ...] now, as a resumable campaign. Returns the finished job."""
+    return run_job(enqueue_personalized(customer_message_list, description, delay_seconds, message_type,
+                                        claimed=True))
+
+def send_rendered_campaign(recipients, renderer, params=None, description='', delay_seconds=10,
+                           message_type='general'):
+    """Send to [(phone, name), ...] now, rendering each message just in time. Returns the finished job."""
+    return run_job(enqueue_rendered(recipients, renderer, params, description, delay_seconds, message_type,
+                                    claimed=True))
+
+def interrupted_jobs():
+    """
+    Unassigned jobs that were cut off part way (some recipients done, or
+    their worker died), after requeueing any whose worker died. Fresh
+    jobs waiting for the send worker are not listed.
+    """
+    requeue_stale_jobs()
+    jobs = []
+    for job_id in sorted(os.listdir(PENDING_DIR)):
+        if _marker_account(os.path.join(PENDING_DIR, job_id)):
+            continue
+        job = job_status(job_id)
+        if job and (job.get('cursor') or job.get('requeued')):
+            jobs.append(job)
+    return jobs
+
+# =============================================
+# SENDER ACCOUNT POOL
+# =============================================
+
+def _payload_slice(job, start, end):
+    payload = dict(job['payload'])
+    key = {'bulk': 'phones', 'personalized': 'messages', 'rendered': 'recipients'}[job['kind']]
+    payload[key] = payload[key][start:end]
+    if payload.get('dead_letters'):
+        payload['dead_letters'] = payload['dead_letters'][start:end]
+    return payload
+
+def shard_job(job_id, accounts):
+    """
+    Split a pending job's remaining recipients into one child job per
+    account. The parent then only tracks its children. Returns child IDs.
+    """
+    ensure_queue_dirs()
+    try:
+        os.rename(os.path.join(PENDING_DIR, job_id), os.path.join(RUNNING_DIR, job_id))
+    except FileNotFoundError:
+        return []  # claimed meanwhile
+    job = get_job(job_id, payload=True)
+    start = job.get('cursor', 0)
+    remaining = job['total'] - start
+    size = -(-remaining // len(accounts))
+    children = []
+    for n, account in enumerate(accounts):
+        lo = start + n * size
+        hi = min(lo + size, job['total'])
+        if lo >= hi:
+            break
+        children.append(_enqueue(
+            job['kind'], _payload_slice(job, lo, hi), hi - lo,
+            f"{job['description'].split(' (part ')[0]} (part {n + 1} via {account})".strip(),
+            job['delay_seconds'], job.get('message_type', 'general'),
+            account=account, parent=job_id, lane=job_lane(job),
+        ))
+    # Recipients the parent already finished stay counted in the parent
+    job.update(status='sharded', children=children, heartbeat=_now())
+    save_job(job)
+    os.remove(os.path.join(RUNNING_DIR, job_id))
+    logging.info(f"Split job {job_id} into {len(children)} parts: {', '.join(accounts)}")
+    return children
+
+def assign_pending_jobs():
+    """
+    Give every unassigned pending job to the healthy accounts: big ones
+    are split across all of them, small ones go to one account in turn.
+    """
+    healthy = healthy_accounts()
+    if not healthy:
+        return 0
+    assigned = 0
+    for job_id in sorted(os.listdir(PENDING_DIR)):
+        if _marker_account(os.path.join(PENDING_DIR, job_id)):
+            continue
+        job = get_job(job_id)
+        if not job:
+            continue
+        # Accounts that gave the job up as unhealthy only get it back if nobody else can send
+        accounts = [a for a in healthy if a not in job.get('avoid_accounts', [])] or healthy
+        if len(accounts) > 1 and job['total'] - job.get('cursor', 0) >= SHARD_MIN_RECIPIENTS:
+            shard_job(job_id, accounts)
+        else:
+            account = accounts[assigned % len(accounts)]
+            job['account'] = account
+            save_job(job)
+            _write_marker(job_id, account)
+        assigned += 1
+    return assigned
+
+def run_worker(poll_seconds=5, once=False, account=None, assigned_only=False):
+    """
+    Process queued jobs forever (or until the queue is empty if once=True).
+    With `account`, sends through that sender account and also takes the
+    jobs assigned to it (only those, if assigned_only). Scheduled jobs are
+    released as they come due (by the pool supervisor if assigned_only).
+    """
+    if account:
+        activate_account(account)
+    requeue_stale_jobs()
+    while True:
+        if not assigned_only:
+            release_due_jobs()
+        if account and not account_healthy(account):
+            if once:
+                return
+            time.sleep(poll_seconds)
+            continue
+        job_id = _claim_next_job(account, assigned_only)
+        if job_id:
+            print(f"  ▶️  {account or 'Worker'}: running job {job_id}")
+            job = run_job(job_id, preempt=partial(_lane_waiting, account=account, assigned_only=assigned_only))
+            if job['status'] == 'queued':
+                print(f"  ⏸️  Job {job_id} paused at {job['cursor']}/{job['total']}, back in the queue")
+                continue
+            print(f"  {'✅' if job['status'] == 'done' else '❌'} Job {job_id}: "
+                  f"{job['sent']} sent, {job['failed']} failed, {job['suppressed']} capped")
+            continue
+        if once:
+            return
+        time.sleep(poll_seconds)
+
+def _start_sender(name, poll_seconds):
+    worker = multiprocessing.Process(target=run_worker, name=f'sender-{name}', daemon=True,
+                                     kwargs={'poll_seconds': poll_seconds, 'account': name,
+                                             'assigned_only': True})
+    worker.start()
+    return worker
+
+def run_pool(poll_seconds=5):
+    """
+    Run one worker process per pool account (see pool_accounts), keep
+    splitting big jobs across the healthy ones and restart any worker
+    that dies. Falls back to a single worker with fewer than two.
+    """
+    accounts = pool_accounts()
+    left_out = [a['name'] for a in load_sender_accounts() if a['name'] not in accounts]
+    if left_out:
+        print(f"  ⚠️  Not used (only one browser/pywhatkit account can send at a time): {', '.join(left_out)}")
+        logging.warning(f"Pool leaves out pywhatkit accounts {', '.join(left_out)}")
+    if len(accounts) < 2:
+        return run_worker(poll_seconds)
+    workers = {name: _start_sender(name, poll_seconds) for name in accounts}
+    print(f"  👥 Sending with {len(workers)} accounts: {', '.join(accounts)}")
+    try:
+        while True:
+            for name, worker in workers.items():
+                if not worker.is_alive():
+                    logging.warning(f"Sender {name} exited (code {worker.exitcode}), restarting it")
+                    workers[name] = _start_sender(name, poll_seconds)
+            requeue_stale_jobs()
+            release_due_jobs()
+            assign_pending_jobs()
+            time.sleep(poll_seconds)
+    finally:
+        for worker in workers.values():
+            worker.terminate()
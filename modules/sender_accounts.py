@@ -0,0 +1,129 @@
+# ============================================
+# Bhure Electrical - Sender Accounts
+# ============================================
+# A pool of WhatsApp sender accounts, so big campaigns can be split and
+# sent in parallel (one worker process per account, see send_queue).
+# Each account has its own transport settings, rate limits and health.
+#
+# Accounts are listed in data/sender_accounts.json, e.g.:
+#   [
+#     {"name": "shop", "transport": "cloud",
+#      "phone_number_id": "...", "access_token": "...",
+#      "limits": {"minute": [20, 60], "hour": [600, 3600], "day": [5000, 86400]}},
+#     {"name": "counter2", "transport": "cloud", ...}
+#   ]
+# Without the file there is no pool and everything goes through the one
+# default transport, as before.
+#
+# pywhatkit accounts all drive the one desktop browser, so at most one
+# of them takes part in the pool; API transports can all run side by side.
+
+import os
+import json
+import time
+import logging
+
+from modules.transports import create_transport, set_transport
+from modules.whatsapp_sender import SendRateLimiter, set_rate_limiter, file_lock, LOG_DIR
+
+SENDER_ACCOUNTS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'sender_accounts.json')
+ACCOUNT_HEALTH_DIR = os.path.join(LOG_DIR, 'accounts')
+
+# An account that fails this many sends in a row (transient errors only;
+# a bad number says nothing about the account) rests for the cooldown.
+UNHEALTHY_AFTER_FAILURES = 5
+UNHEALTHY_COOLDOWN_SECONDS = 15 * 60
+
+# Transports that several processes can send through at the same time
+PARALLEL_TRANSPORTS = {'cloud', 'fake'}
+
+class AccountUnhealthy(Exception):
+    """The sender account should stop sending for now"""
+    pass
+
+def load_sender_accounts():
+    """Configured sender accounts ([] if there is no pool)"""
+    if not os.path.exists(SENDER_ACCOUNTS_FILE):
+        return []
+    with open(SENDER_ACCOUNTS_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def get_sender_account(name):
+    for account in load_sender_accounts():
+        if account['name'] == name:
+            return account
+    return None
+
+def account_transport(account):
+    return (account.get('transport') or os.environ.get('WHATSAPP_TRANSPORT') or 'pywhatkit').strip().lower()
+
+def pool_accounts():
+    """Names of the accounts that can send in parallel: every API account and the first pywhatkit one"""
+    names, browser = [], False
+    for account in load_sender_accounts():
+        if account_transport(account) in PARALLEL_TRANSPORTS:
+            names.append(account['name'])
+        elif not browser:
+            browser = True
+            names.append(account['name'])
+    return names
+
+def activate_account(name):
+    """Send everything in this process through the named account"""
+    account = get_sender_account(name)
+    if account is None:
+        raise ValueError(f"Unknown sender account: {name}")
+    set_transport(create_transport(account.get('transport'), account))
+    limits = {k: tuple(v) for k, v in account['limits'].items()} if account.get('limits') else None
+    set_rate_limiter(SendRateLimiter(
+        limits=limits,
+        state_file=os.path.join(LOG_DIR, f'send_rate_limit_{name}.json'),
+    ))
+    logging.info(f"Sending as account {name} ({account.get('transport', 'pywhatkit')})")
+    return account
+
+# =============================================
+# HEALTH
+# =============================================
+
+def _health_file(name):
+    return os.path.join(ACCOUNT_HEALTH_DIR, f'{name}.json')
+
+def load_account_health(name):
+    path = _health_file(name)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'sent': 0, 'failed': 0, 'consecutive_failures': 0,
+            'unhealthy_until': 0, 'last_error': None}
+
+def record_account_result(name, detail):
+    """Update an account's health from one send result; returns the health record"""
+    if detail['status'] not in ('sent', 'failed'):
+        return load_account_health(name)  # suppressed: nothing was sent
+    with file_lock(_health_file(name)):  # every process sending as this account updates it
+        health = load_account_health(name)
+        if detail['status'] == 'sent':
+            health['sent'] += 1
+            health['consecutive_failures'] = 0
+        else:
+            health['failed'] += 1
+            health['last_error'] = detail.get('message')
+            if not detail.get('permanent'):
+                health['consecutive_failures'] += 1
+            if health['consecutive_failures'] >= UNHEALTHY_AFTER_FAILURES:
+                health['unhealthy_until'] = time.time() + UNHEALTHY_COOLDOWN_SECONDS
+                health['consecutive_failures'] = 0
+                logging.warning(f"Account {name} marked unhealthy: {health['last_error']}")
+        tmp = f'{_health_file(name)}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(health, f)
+        os.replace(tmp, _health_file(name))
+    return health
+
+def account_healthy(name):
+    return load_account_health(name)['unhealthy_until'] <= time.time()
+
+def healthy_accounts():
+    """Names of pool accounts that can send right now"""
+    return [name for name in pool_accounts() if account_healthy(name)]
@@ -0,0 +1,303 @@
+# ============================================
+# Bhure Electrical - Message Transports
+# ============================================
+# The WhatsApp senders don't talk to pywhatkit directly; they go through
+# a transport. The default one drives WhatsApp Web via pywhatkit. The
+# fake one sends nothing and just simulates latency and failures, so
+# campaigns, the queue and the dashboard can be exercised without a
+# phone or a browser.
+#
+# Pick the transport with the WHATSAPP_TRANSPORT environment variable:
+#   WHATSAPP_TRANSPORT=pywhatkit   (default)
+#   WHATSAPP_TRANSPORT=fake        (+ WHATSAPP_FAKE_LATENCY, WHATSAPP_FAKE_FAILURE_RATE)
+#   WHATSAPP_TRANSPORT=cloud       WhatsApp Business Cloud API over HTTP
+#                                  (+ WHATSAPP_PHONE_NUMBER_ID, WHATSAPP_ACCESS_TOKEN,
+#                                     WHATSAPP_API_URL, WHATSAPP_MAX_IN_FLIGHT)
+
+import os
+import time
+import random
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pywhatkit as kit
+    PYWHATKIT_AVAILABLE = True
+except ImportError:
+    kit = None
+    PYWHATKIT_AVAILABLE = False
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    requests = None
+    REQUESTS_AVAILABLE = False
+
+CLOUD_API_URL = 'https://graph.facebook.com/v19.0'
+CLOUD_MEDIA_REUSE_SECONDS = 24 * 60 * 60  # re-upload after this (uploaded media expires)
+
+# Cloud API error codes that mean "slow down", not "this will never work"
+CLOUD_RATE_LIMIT_CODES = {4, 80007, 130429, 131048, 131056}
+
+class TransportError(Exception):
+    """
+    A message could not be sent. permanent=True means retrying won't help
+    (bad number, rejected message); otherwise the failure is transient.
+    """
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+class PyWhatKitTransport:
+    """Sends through WhatsApp Web in the default browser (one tab per message)"""
+
+    name = 'pywhatkit'
+    schedules = True  # send_text_at() really sends at the given time
+
+    def check(self):
+        """(ok, error message) - can this transport send right now?"""
+        if not PYWHATKIT_AVAILABLE:
+            return False, "WhatsApp sending not available on this server (requires local browser). Use locally on your Mac."
+        return True, ""
+
+    def send_text(self, phone, message, wait_time=12):
+        """Send a text message now"""
+        kit.sendwhatmsg_instantly(
+            phone_no=phone,
+            message=message,
+            wait_time=wait_time,
+            tab_close=True
+        )
+
+    def send_text_at(self, phone, message, hour, minute, wait_time=15):
+        """Send a text message at hour:minute today"""
+        kit.sendwhatmsg(
+            phone_no=phone,
+            message=message,
+            time_hour=hour,
+            time_min=minute,
+            wait_time=wait_time,
+            tab_close=True
+        )
+
+    def send_image(self, phone, image_path, caption='', wait_time=15):
+        """Send an image with an optional caption"""
+        kit.sendwhats_image(
+            receiver=phone,
+            img_path=image_path,
+            caption=caption,
+            wait_time=wait_time,
+            tab_close=True
+        )
+
+class FakeTransport:
+    """
+    Pretends to send. Deterministic for a given seed: the same sequence of
+    sends always fails at the same positions. Every attempt is recorded
+    in .outbox for inspection.
+    """
+
+    name = 'fake'
+    schedules = True
+
+    def __init__(self, latency_seconds=0.0, failure_rate=0.0, seed=0, permanent_failure_rate=0.0):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.permanent_failure_rate = permanent_failure_rate
+        self.outbox = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def check(self):
+        return True, ""
+
+    def _send(self, kind, phone, **fields):
+        with self._lock:
+            roll = self._random.random()
+            permanent = roll < self.permanent_failure_rate
+            fail = roll < self.permanent_failure_rate + self.failure_rate
+            self.outbox.append(dict(
+                kind=kind, phone=phone, status='failed' if fail else 'sent',
+                timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **fields
+            ))
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if fail:
+            raise TransportError(f"Simulated {'permanent' if permanent else 'transient'} failure sending to {phone}",
+                                 permanent=permanent)
+
+    def send_text(self, phone, message, wait_time=12):
+        self._send('text', phone, message=message)
+
+    def send_text_at(self, phone, message, hour, minute, wait_time=15):
+        self._send('text', phone, message=message, at=f'{hour:02d}:{minute:02d}')
+
+    def send_image(self, phone, image_path, caption='', wait_time=15):
+        self._send('image', phone, image_path=image_path, caption=caption)
+
+class CloudAPITransport:
+    """
+    Sends through a WhatsApp Business Cloud API compatible HTTP endpoint.
+    
+    One pooled keep-alive session is shared by all sends; at most
+    max_in_flight requests run at the same time, however many threads
+    call in. Successful sends return the message ID from the response.
+    """
+
+    name = 'cloud'
+    schedules = False  # no scheduled sends; queue a job with send_at instead
+
+    def __init__(self, phone_number_id, access_token, api_url=CLOUD_API_URL,
+                 max_in_flight=4, timeout=30):
+        self.phone_number_id = phone_number_id
+        self.access_token = access_token
+        self.api_url = api_url.rstrip('/')
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._media_ids = {}  # image path -> (media ID, upload time)
+        self._media_lock = threading.Lock()
+
+    def check(self):
+        if not REQUESTS_AVAILABLE:
+            return False, "The 'requests' package is needed for the Cloud API transport (pip install requests)"
+        if not self.phone_number_id or not self.access_token:
+            return False, "Set WHATSAPP_PHONE_NUMBER_ID and WHATSAPP_ACCESS_TOKEN for the Cloud API transport"
+        return True, ""
+
+    @property
+    def session(self):
+        with self._session_lock:  # send_texts threads may all arrive here first
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Authorization'] = f'Bearer {self.access_token}'
+                self._session = session
+            return self._session
+
+    def _post(self, path, **kwargs):
+        """POST to the API and return the parsed JSON; raises TransportError"""
+        url = f'{self.api_url}/{self.phone_number_id}/{path}'
+        with self._slots:
+            try:
+                resp = self.session.post(url, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                raise TransportError(f"Cloud API request failed: {e}")  # network: transient
+        try:
+            data = resp.json()
+        except ValueError:
+            data = {}
+        if resp.status_code >= 400 or 'error' in data:
+            error = data.get('error')
+            if not isinstance(error, dict):
+                error = {'message': str(error)} if error else {}
+            code = error.get('code', resp.status_code)
+            permanent = (400 <= resp.status_code < 500 and resp.status_code != 429
+                         and code not in CLOUD_RATE_LIMIT_CODES)
+            raise TransportError(f"Cloud API error {code}: {error.get('message', resp.text[:200])}",
+                                 permanent=permanent)
+        return data
+
+    def _send_message(self, phone, kind, body):
+        data = self._post('messages', json={
+            'messaging_product': 'whatsapp',
+            'to': str(phone).lstrip('+'),
+            'type': kind,
+            kind: body,
+        })
+        messages = data.get('messages') or [{}]
+        return messages[0].get('id')
+
+    def send_text(self, phone, message, wait_time=12):
+        return self._send_message(phone, 'text', {'body': message, 'preview_url': False})
+
+    def send_text_at(self, phone, message, hour, minute, wait_time=15):
+        raise TransportError("The Cloud API can't send at a set time; queue a job with send_at instead",
+                             permanent=True)
+
+    def upload_media(self, image_path):
+        """Upload an image once and reuse its media ID for later sends"""
+        with self._media_lock:
+            media_id, uploaded = self._media_ids.get(image_path, (None, 0))
+            if media_id and time.time() - uploaded < CLOUD_MEDIA_REUSE_SECONDS:
+                return media_id
+            with open(image_path, 'rb') as f:
+                media = self._post('media', data={'messaging_product': 'whatsapp'},
+                                   files={'file': (os.path.basename(image_path), f, _image_mime(image_path))})
+            self._media_ids[image_path] = (media['id'], time.time())
+            return media['id']
+
+    def send_image(self, phone, image_path, caption='', wait_time=15):
+        return self._send_message(phone, 'image', {'id': self.upload_media(image_path), 'caption': caption})
+
+    def send_texts(self, messages):
+        """
+        Send [(phone, message), ...] concurrently (up to max_in_flight).
+        Returns [(phone, message_id or None, exception or None, seconds), ...]
+        in input order.
+        """
+        def send_one(pair):
+            phone, message = pair
+            started = time.time()
+            try:
+                return phone, self.send_text(phone, message), None, time.time() - started
+            except Exception as e:
+                return phone, None, e, time.time() - started
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            return list(pool.map(send_one, messages))
+
+def _image_mime(path):
+    ext = os.path.splitext(path)[1].lower()
+    return {'.png': 'image/png', '.webp': 'image/webp'}.get(ext, 'image/jpeg')
+
+def create_transport(name=None, options=None):
+    """
+    Build a transport by name (default: WHATSAPP_TRANSPORT env var, else
+    pywhatkit). Settings come from `options` (e.g. a sender account's
+    config) and fall back to the WHATSAPP_* environment variables.
+    """
+    options = options or {}
+    name = (name or os.environ.get('WHATSAPP_TRANSPORT') or 'pywhatkit').strip().lower()
+
+    def setting(key, env, default):
+        return options.get(key, os.environ.get(env, default))
+
+    if name == 'fake':
+        return FakeTransport(
+            latency_seconds=float(setting('latency_seconds', 'WHATSAPP_FAKE_LATENCY', 0)),
+            failure_rate=float(setting('failure_rate', 'WHATSAPP_FAKE_FAILURE_RATE', 0)),
+            permanent_failure_rate=float(setting('permanent_failure_rate', 'WHATSAPP_FAKE_PERMANENT_FAILURE_RATE', 0)),
+            seed=options.get('seed', 0),
+        )
+    if name == 'cloud':
+        return CloudAPITransport(
+            phone_number_id=setting('phone_number_id', 'WHATSAPP_PHONE_NUMBER_ID', ''),
+            access_token=setting('access_token', 'WHATSAPP_ACCESS_TOKEN', ''),
+            api_url=setting('api_url', 'WHATSAPP_API_URL', CLOUD_API_URL),
+            max_in_flight=int(setting('max_in_flight', 'WHATSAPP_MAX_IN_FLIGHT', 4)),
+        )
+    if name == 'pywhatkit':
+        return PyWhatKitTransport()
+    raise ValueError(f"Unknown WhatsApp transport: {name}")
+
+_transport = None
+
+def get_transport():
+    """The transport used by whatsapp_sender (created on first use)"""
+    global _transport
+    if _transport is None:
+        _transport = create_transport()
+    return _transport
+
+def set_transport(transport):
+    """Swap the transport (e.g. a FakeTransport for load tests); returns the old one"""
+    global _transport
+    old, _transport = _transport, transport
+    return old
@@ -1,20 +1,24 @@
 # ============================================
 # Bhure Electrical - WhatsApp Messaging Module
 # ============================================
-# Handles sending messages via WhatsApp Web using pywhatkit
-
-try:
-    import pywhatkit as kit
-    PYWHATKIT_AVAILABLE = True
-except ImportError:
-    kit = None
-    PYWHATKIT_AVAILABLE = False
+# Handles sending messages via WhatsApp Web (see transports.py for
+# the pywhatkit backend and the fake one used for testing)
 
+import re
+import csv
 import time
 import os
 import json
+import uuid
+import random
 import logging
-from datetime import datetime
+from collections import deque
+from contextlib import contextmanager, nullcontext, ExitStack
+from datetime import datetime, timedelta
+
+from modules.transports import get_transport, PYWHATKIT_AVAILABLE
+from modules.media_cache import prepare_image
+from modules.send_metrics import record_send_metric
 
 # Setup logging
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
@@ -26,28 +30,715 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Message log file
-MESSAGE_LOG = os.path.join(LOG_DIR, 'message_history.json')
+@contextmanager
+def file_lock(path, timeout=30, stale_seconds=60):
+    """
+    Hold `path`.lock while reading and rewriting a file that the app, the
+    web server and the send workers all update, so no update is lost.
+    A lock older than stale_seconds was left by a crashed process and is
+    taken over. Raises TimeoutError if the lock can't be had in time
+    (timeout=0: try once, for work that can just be skipped).
+    """
+    lock = path + '.lock'
+    os.makedirs(os.path.dirname(lock), exist_ok=True)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) > stale_seconds:
+                    os.remove(lock)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Timed out waiting for {lock}")
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
 
-def load_message_history():
-    """Load message sending history"""
-    if os.path.exists(MESSAGE_LOG):
-        with open(MESSAGE_LOG, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+# Message history: append-only JSON Lines, one file per day
+# (logs/history/messages_YYYY-MM-DD.jsonl). Logging a send appends one
+# line instead of rewriting the whole history.
+HISTORY_DIR = os.path.join(LOG_DIR, 'history')
+MESSAGE_LOG = os.path.join(LOG_DIR, 'message_history.json')  # legacy JSON array
+HISTORY_FILE_PREFIX = 'messages_'
+# Running counters kept in step with the history so stats never scan it
+MESSAGE_STATS = os.path.join(HISTORY_DIR, 'stats.json')
+
+def _history_file(day):
+    return os.path.join(HISTORY_DIR, f'{HISTORY_FILE_PREFIX}{day}.jsonl')
+
+def _append_history(entries):
+    """Append entries to their day's history file(s)"""
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    by_day = {}
+    for entry in entries:
+        day = str(entry.get('timestamp', ''))[:10] or datetime.now().strftime('%Y-%m-%d')
+        by_day.setdefault(day, []).append(entry)
+    for day, day_entries in by_day.items():
+        with open(_history_file(day), 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in day_entries))
+
+def migrate_legacy_message_history():
+    """
+    One-time move of logs/message_history.json (a JSON array) into the
+    daily JSONL files. The old file is kept as message_history.json.migrated.
+    """
+    if not os.path.exists(MESSAGE_LOG):
+        return 0
+    with open(MESSAGE_LOG, 'r', encoding='utf-8') as f:
+        history = json.load(f)
+    _append_history(history)
+    os.replace(MESSAGE_LOG, MESSAGE_LOG + '.migrated')
+    rebuild_message_stats()
+    logging.info(f"Migrated {len(history)} message log entries to {HISTORY_DIR}")
+    return len(history)
+
+def history_days():
+    """Dates (YYYY-MM-DD) that have a history file, oldest first"""
+    migrate_legacy_message_history()
+    if not os.path.isdir(HISTORY_DIR):
+        return []
+    return sorted(f[len(HISTORY_FILE_PREFIX):-len('.jsonl')] for f in os.listdir(HISTORY_DIR)
+                  if f.startswith(HISTORY_FILE_PREFIX) and f.endswith('.jsonl'))
+
+def iter_message_history(start=None, end=None):
+    """
+    Stream message log entries, oldest first, one at a time.
+    
+    Args:
+        start, end: Optional 'YYYY-MM-DD' bounds (inclusive); only the
+            daily files inside the range are opened.
+    """
+    for day in history_days():
+        if (start and day < start) or (end and day > end):
+            continue
+        with open(_history_file(day), 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial line from an interrupted write
+
+def load_message_history(start=None, end=None):
+    """Load message sending history as a list (prefer iter_message_history for big ranges)"""
+    return list(iter_message_history(start, end))
 
 def save_message_log(log_entry):
     """Save a message log entry"""
-    history = load_message_history()
-    history.append(log_entry)
-    with open(MESSAGE_LOG, 'w', encoding='utf-8') as f:
-        json.dump(history, f, indent=2, ensure_ascii=False)
+    save_message_logs([log_entry])
+
+def save_message_logs(entries):
+    """Save several message log entries at once"""
+    migrate_legacy_message_history()
+    _append_history(entries)
+    update_message_stats(entries)
+    if any(e.get('status') == 'sent' and e.get('phone') for e in entries):
+        update_contact_index()
+
+# =============================================
+# PYWHATKIT LOG INGESTION
+# =============================================
+# pywhatkit appends every message it sends to PyWhatKit_DB.txt in the
+# working directory, including ones sent outside this app:
+#   Date: 16/2/2026
+#   Time: 14:33
+#   Phone Number: +919611301699
+#   Message: Hi siddu
+#   --------------------
+# ingest_pywhatkit_log() reads the file from the byte offset it stopped
+# at last time and adds the new records to the message history, skipping
+# ones the history already has, so stats and frequency caps count them.
+# pywhatkit writes its record before our own log entry is saved, so
+# records from the last PYWHATKIT_MATCH_SECONDS are left for the next
+# call. The file has \r\n line endings when written on Windows.
+PYWHATKIT_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'PyWhatKit_DB.txt')
+PYWHATKIT_OFFSET = os.path.join(HISTORY_DIR, 'pywhatkit_offset.json')
+PYWHATKIT_SEPARATOR = re.compile(rb'\r?\n-{20}\r?\n')
+PYWHATKIT_MATCH_SECONDS = 10 * 60  # pywhatkit logs minutes; our timestamps are taken after sending
+PYWHATKIT_READ_BYTES = 1024 * 1024
+
+def _iter_pywhatkit_records(path, offset):
+    """Yield (record dict, offset after it) for complete records from `offset` on"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        buffer = b''
+        while True:
+            chunk = f.read(PYWHATKIT_READ_BYTES)
+            if not chunk:
+                return  # a trailing partial record is read next time
+            buffer += chunk
+            while True:
+                match = PYWHATKIT_SEPARATOR.search(buffer)
+                if not match:
+                    break
+                text = buffer[:match.start()].decode('utf-8', errors='replace').replace('\r\n', '\n')
+                offset += match.end()
+                buffer = buffer[match.end():]
+                yield _parse_pywhatkit_record(text), offset
+
+def _parse_pywhatkit_record(text):
+    """Fields of one record; lines without a 'Key:' belong to the previous field"""
+    record, key = {}, None
+    for line in text.strip('\n').split('\n'):
+        name, sep, value = line.partition(': ')
+        if sep and name in ('Date', 'Time', 'Phone Number', 'Group ID', 'Message', 'Image', 'Caption'):
+            key = name
+            record[key] = value
+        elif key:
+            record[key] += '\n' + line
+    return record
+
+def _pywhatkit_entry(record):
+    """(history entry, full text) for a record; entry is None for group messages and unreadable records"""
+    text = record.get('Message', record.get('Caption', ''))
+    if not record.get('Phone Number'):
+        return None, text
+    try:
+        day, month, year = (int(x) for x in record['Date'].split('/'))
+        hour, minute = (int(x) for x in record['Time'].split(':'))
+        sent = datetime(year, month, day, hour, minute)
+    except (KeyError, ValueError):
+        return None, text
+    entry = {
+        'phone': _normalize_phone(record['Phone Number']),
+        'message_preview': text[:100] + '...' if len(text) > 100 else text,
+        'status': 'sent',
+        'timestamp': sent.strftime('%Y-%m-%d %H:%M:%S'),
+        'type': 'pywhatkit',
+    }
+    if 'Image' in record:
+        entry['image'] = record['Image']
+    return entry, text
+
+def _message_key(text):
+    """Text compared across logs: pywhatkit drops newlines and repeated spaces"""
+    return re.sub(r'\s+', '', text)
+
+def _logged_text_key(entry):
+    text = entry.get('message_preview') or entry.get('caption') or ''
+    if len(text) == 103 and text.endswith('...'):
+        text = text[:-3]  # truncated preview: compare as a prefix
+    return _message_key(text)
+
+def _already_logged(entry, text, logged):
+    """
+    True if the history already has this message: same phone, same text,
+    sent within the match window. `logged` caches the history per day as
+    [(time, phone, text key)]; matched messages are taken out of it.
+    """
+    ts = datetime.strptime(entry['timestamp'], '%Y-%m-%d %H:%M:%S')
+    key = _message_key(text)
+    for delta in (-1, 0, 1):
+        day = (ts + timedelta(days=delta)).strftime('%Y-%m-%d')
+        if day not in logged:
+            logged[day] = [(datetime.strptime(e['timestamp'], '%Y-%m-%d %H:%M:%S'), e['phone'], _logged_text_key(e))
+                           for e in iter_message_history(start=day, end=day)
+                           if e.get('status') == 'sent' and e.get('phone') and e.get('timestamp')]
+        for i, (logged_ts, phone, logged_key) in enumerate(logged[day]):
+            if phone == entry['phone'] and abs((logged_ts - ts).total_seconds()) <= PYWHATKIT_MATCH_SECONDS \
+                    and (key.startswith(logged_key) if logged_key else not key):
+                del logged[day][i]  # each logged message matches one record only
+                return True
+    return False
+
+def _load_pywhatkit_offset():
+    try:
+        with open(PYWHATKIT_OFFSET, 'r', encoding='utf-8') as f:
+            return json.load(f)['offset']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return 0
+
+def _save_pywhatkit_offset(offset):
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    tmp = f'{PYWHATKIT_OFFSET}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'offset': offset, 'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f)
+    os.replace(tmp, PYWHATKIT_OFFSET)
+
+def ingest_pywhatkit_log(path=PYWHATKIT_DB):
+    """
+    Add messages pywhatkit logged since the last call to the message
+    history. Returns the number of entries added.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == _load_pywhatkit_offset():
+        return 0
+    
+    # One process at a time, or two could add the same records
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(file_lock(PYWHATKIT_OFFSET, timeout=0, stale_seconds=5 * 60))
+        except TimeoutError:
+            return 0  # another process is reading it right now
+        offset = _load_pywhatkit_offset()  # it may have moved while we waited
+        if os.path.getsize(path) < offset:
+            offset = 0  # file was truncated or replaced; duplicates are skipped below
+        added, logged, batch = 0, {}, []
+        recent = (datetime.now() - timedelta(seconds=PYWHATKIT_MATCH_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+        for record, end in _iter_pywhatkit_records(path, offset):
+            entry, text = _pywhatkit_entry(record)
+            if entry and entry['timestamp'] > recent:
+                break  # its sender may not have logged it yet; read it again next time
+            if entry and not _already_logged(entry, text, logged):
+                batch.append(entry)
+            offset = end
+            if len(batch) >= 500:
+                save_message_logs(batch)
+                added += len(batch)
+                batch = []
+                _save_pywhatkit_offset(offset)
+        if batch:
+            save_message_logs(batch)
+            added += len(batch)
+        _save_pywhatkit_offset(offset)
+    if added:
+        logging.info(f"Added {added} messages from {os.path.basename(path)} to the history")
+    return added
+
+# =============================================
+# RETRIES & DEAD LETTERS
+# =============================================
+# Bulk sends retry transient failures; messages that still fail (or fail
+# permanently) are kept in logs/dead_letters.jsonl so they can be
+# looked at and sent again later instead of being silently dropped.
+SEND_RETRIES = 3            # extra attempts after a transient failure
+RETRY_BACKOFF_SECONDS = 5   # wait before retry n: 5s * 2^(n-1) + jitter
+DEAD_LETTERS = os.path.join(LOG_DIR, 'dead_letters.jsonl')
+
+def add_dead_letter(phone, message, message_type, outcome):
+    """Record a message that could not be delivered"""
+    entry = {
+        'id': uuid.uuid4().hex[:8],
+        'phone': phone,
+        'message': message,
+        'message_type': message_type,
+        'error': outcome['message'],
+        'attempts': outcome['attempts'],
+        'permanent': outcome['permanent'],
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with file_lock(DEAD_LETTERS):
+        with open(DEAD_LETTERS, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    return entry
+
+def load_dead_letters():
+    """All undelivered messages, oldest first"""
+    if not os.path.exists(DEAD_LETTERS):
+        return []
+    entries = []
+    with open(DEAD_LETTERS, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return entries
+
+def _rewrite_dead_letters(change):
+    """Apply change(entries) -> entries to the store under its lock"""
+    with file_lock(DEAD_LETTERS):
+        entries = change(load_dead_letters())
+        tmp = f'{DEAD_LETTERS}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entries))
+        os.replace(tmp, DEAD_LETTERS)
+
+def take_dead_letters(ids=None):
+    """Remove dead letters (all, or those with the given IDs) and return them"""
+    wanted = None if ids is None else set(ids)
+    taken = []
+    
+    def remove(entries):
+        taken.extend(e for e in entries if wanted is None or e['id'] in wanted)
+        return [e for e in entries if not (wanted is None or e['id'] in wanted)]
+    _rewrite_dead_letters(remove)
+    return taken
+
+def mark_dead_letters(ids, **fields):
+    """Set fields (e.g. the resend job) on the dead letters with the given IDs"""
+    wanted = set(ids)
+    _rewrite_dead_letters(lambda entries: [dict(e, **fields) if e['id'] in wanted else e for e in entries])
+
+def replay_dead_letters(ids=None, delay_seconds=10, on_progress=None):
+    """
+    Send dead letters again (all, or the given IDs). An entry is removed
+    once it is sent, or once it fails again (the failure is stored as a
+    new dead letter). Entries skipped by the opt-out list or a frequency
+    cap stay in the store for a later replay.
+    """
+    wanted = None if ids is None else set(ids)
+    by_type = {}
+    for e in load_dead_letters():
+        if wanted is None or e['id'] in wanted:
+            by_type.setdefault(e.get('message_type', 'general'), []).append(e)
+    totals = {'total': 0, 'sent': 0, 'failed': 0, 'suppressed': 0, 'details': []}
+    for message_type, entries in by_type.items():
+        replaying = iter(entries)
+        
+        def progress(detail, replaying=replaying):
+            entry = next(replaying)
+            if detail['status'] != 'suppressed':
+                take_dead_letters([entry['id']])
+            if on_progress:
+                on_progress(detail)
+        results = send_personalized_messages([(e['phone'], e['message']) for e in entries],
+                                             delay_seconds=delay_seconds, on_progress=progress,
+                                             message_type=message_type)
+        for key in ('total', 'sent', 'failed', 'suppressed'):
+            totals[key] += results[key]
+        totals['details'].extend(results['details'])
+    return totals
 
-def _check_pywhatkit():
-    """Check if pywhatkit is available"""
-    if not PYWHATKIT_AVAILABLE:
-        return False, "WhatsApp sending not available on this server (requires local browser). Use locally on your Mac."
-    return True, ""
+# =============================================
+# FREQUENCY CAPPING
+# =============================================
+# Limits how often one customer hears from the shop. A message of a
+# given type is only sent if the customer got fewer than `max` messages
+# (of any type) in the last `days` days. None = never capped.
+FREQUENCY_CAPS = {
+    'transactional': None,  # thank-yous, payment/loyalty confirmations
+    'reminder': None,       # payment reminders
+    'individual': None,     # a message the shop typed for one customer
+    'statement': (3, 7),    # bill summaries broadcast to a whole segment
+    'festival': (3, 7),
+    'arrivals': (2, 7),
+    'offer': (2, 7),
+    'general': (3, 7),
+}
+CONTACT_HISTORY_SIZE = 10  # send timestamps kept per phone
+
+# The last-contacted index lives in logs/history/contacts.json:
+#   {"offsets": {day: bytes of that day's history already read},
+#    "contacts": {phone: [recent send times, epoch seconds, newest last]}}
+# Whoever logs a send folds the new history lines into it (under a lock),
+# so every process shares one index. A process keeps the parsed copy and
+# only re-reads the file when its mtime changes.
+CONTACT_INDEX = os.path.join(HISTORY_DIR, 'contacts.json')
+
+_contact_index = None
+_contact_index_mtime = None
+
+def _normalize_phone(phone):
+    phone = str(phone).strip()
+    if not phone.startswith('+'):
+        phone = '+91' + phone.lstrip('0')
+    return phone
+
+def _record_contact(entry, index):
+    if entry.get('status') != 'sent' or not entry.get('phone'):
+        return
+    try:
+        ts = datetime.strptime(entry['timestamp'], '%Y-%m-%d %H:%M:%S').timestamp()
+    except (KeyError, ValueError):
+        return
+    index.setdefault(entry['phone'], deque(maxlen=CONTACT_HISTORY_SIZE)).append(ts)
+
+def _read_contact_index():
+    try:
+        with open(CONTACT_INDEX, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'offsets': {}, 'contacts': {}}
+
+def update_contact_index():
+    """
+    Fold history lines added since the last update into contacts.json
+    (reading each day's file from its saved offset) and return the index.
+    Only days inside the longest cap window are kept.
+    """
+    global _contact_index, _contact_index_mtime
+    days = max((cap[1] for cap in FREQUENCY_CAPS.values() if cap), default=0)
+    start = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    with file_lock(CONTACT_INDEX):
+        saved = _read_contact_index()
+        offsets = {day: offset for day, offset in saved['offsets'].items() if day >= start}
+        index = {phone: deque(times, maxlen=CONTACT_HISTORY_SIZE) for phone, times in saved['contacts'].items()}
+        changed = offsets != saved['offsets']
+        for day in history_days():
+            offset = offsets.get(day, 0)
+            if day < start or os.path.getsize(_history_file(day)) <= offset:
+                continue
+            with open(_history_file(day), 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            data = data[:data.rfind(b'\n') + 1]  # a partial last line is read next time
+            for line in data.decode('utf-8', errors='replace').splitlines():
+                try:
+                    _record_contact(json.loads(line), index)
+                except json.JSONDecodeError:
+                    continue
+            offsets[day] = offset + len(data)
+            changed = True
+        if changed:
+            since = datetime.strptime(start, '%Y-%m-%d').timestamp()
+            contacts = {}
+            for phone, times in index.items():
+                recent = [ts for ts in times if ts >= since]
+                if recent:
+                    contacts[phone] = recent
+            tmp = f'{CONTACT_INDEX}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'offsets': offsets, 'contacts': contacts}, f)
+            os.replace(tmp, CONTACT_INDEX)
+            index = {phone: deque(times, maxlen=CONTACT_HISTORY_SIZE) for phone, times in contacts.items()}
+        _contact_index = index
+        _contact_index_mtime = os.path.getmtime(CONTACT_INDEX) if os.path.exists(CONTACT_INDEX) else None
+    return index
+
+def load_contact_index():
+    """The last-contacted index, brought up to date with the history and pywhatkit's log"""
+    ingest_pywhatkit_log()
+    return update_contact_index()
+
+def _current_contact_index():
+    """The index as another process may have left it (re-read only if contacts.json changed)"""
+    try:
+        mtime = os.path.getmtime(CONTACT_INDEX)
+    except FileNotFoundError:
+        mtime = None
+    if _contact_index is None or mtime != _contact_index_mtime:
+        return update_contact_index()
+    return _contact_index
+
+def frequency_cap_allows(phone, message_type='general', now=None):
+    """True if a message of this type may go to this phone now"""
+    cap = FREQUENCY_CAPS.get(message_type, FREQUENCY_CAPS['general'])
+    if not cap:
+        return True
+    max_messages, days = cap
+    since = (now or time.time()) - days * 24 * 60 * 60
+    recent = _current_contact_index().get(_normalize_phone(phone), ())
+    return sum(1 for ts in recent if ts >= since) < max_messages
+
+# =============================================
+# OPT-OUTS
+# =============================================
+# Customers who asked not to be messaged. Every send checks this list
+# right before the transport is called, whatever path it came from.
+# Stored in data/opt_outs.csv (phone, added, reason) and kept in memory
+# as a dict for O(1) lookups; reloaded when another process changes it.
+OPT_OUTS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'opt_outs.csv')
+OPT_OUT_COLUMNS = ['phone', 'added', 'reason']
+
+_opt_outs = None
+_opt_outs_mtime = None
+
+def load_opt_outs(reload=False):
+    """
+    phone -> {'added', 'reason'} for every opted-out phone. reload=True
+    reads the file even if its mtime looks unchanged (two writes can
+    land within the same mtime tick).
+    """
+    global _opt_outs, _opt_outs_mtime
+    try:
+        mtime = os.path.getmtime(OPT_OUTS_FILE)
+    except FileNotFoundError:
+        mtime = None
+    if reload or _opt_outs is None or mtime != _opt_outs_mtime:
+        opt_outs = {}
+        if mtime is not None:
+            with open(OPT_OUTS_FILE, 'r', newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    opt_outs[row['phone']] = {'added': row.get('added', ''), 'reason': row.get('reason', '')}
+        _opt_outs, _opt_outs_mtime = opt_outs, mtime
+    return _opt_outs
+
+def _save_opt_outs(opt_outs):
+    global _opt_outs, _opt_outs_mtime
+    os.makedirs(os.path.dirname(OPT_OUTS_FILE), exist_ok=True)
+    tmp = f'{OPT_OUTS_FILE}.{os.getpid()}.tmp'
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(OPT_OUT_COLUMNS)
+        for phone in sorted(opt_outs):
+            writer.writerow([phone, opt_outs[phone]['added'], opt_outs[phone]['reason']])
+    os.replace(tmp, OPT_OUTS_FILE)
+    _opt_outs, _opt_outs_mtime = opt_outs, os.path.getmtime(OPT_OUTS_FILE)
+
+def _opt_out_key(phone):
+    """+<country code><number>, however the phone was typed ('098765 43210', '+91-98765-43210', ...)"""
+    digits = re.sub(r'\D', '', str(phone)).lstrip('0')
+    return '+' + ('91' + digits if len(digits) == 10 else digits)
+
+def is_opted_out(phone):
+    return _opt_out_key(phone) in load_opt_outs()
+
+def add_opt_outs(phones, reason=''):
+    """Opt phones out of all messages. Returns how many were newly added."""
+    added = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    count = 0
+    with file_lock(OPT_OUTS_FILE):
+        opt_outs = dict(load_opt_outs(reload=True))
+        for phone in phones:
+            phone = _opt_out_key(phone)
+            if phone not in opt_outs and len(phone) > 10:
+                opt_outs[phone] = {'added': added, 'reason': reason}
+                count += 1
+        if count:
+            _save_opt_outs(opt_outs)
+    if count:
+        logging.info(f"Opted out {count} phones ({reason or 'no reason given'})")
+    return count
+
+def remove_opt_outs(phones):
+    """Let phones receive messages again. Returns how many were removed."""
+    with file_lock(OPT_OUTS_FILE):
+        opt_outs = dict(load_opt_outs(reload=True))
+        count = sum(1 for phone in phones if opt_outs.pop(_opt_out_key(phone), None) is not None)
+        if count:
+            _save_opt_outs(opt_outs)
+    if count:
+        logging.info(f"Removed {count} phones from the opt-out list")
+    return count
+
+def import_opt_outs(path, reason='imported'):
+    """
+    Add the phones in a CSV or text file to the opt-out list: the 'phone'
+    column if the file has one, else the first value on each line.
+    Returns how many were newly added.
+    """
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    column = 0
+    if rows and 'phone' in [c.strip().lower() for c in rows[0]]:
+        column = [c.strip().lower() for c in rows[0]].index('phone')
+        rows = rows[1:]
+    phones = [row[column].strip() for row in rows if len(row) > column and row[column].strip()]
+    return add_opt_outs(phones, reason)
+
+def _suppression_reason(phone, message_type):
+    """Why a message must not go to this phone (None if it may)"""
+    if is_opted_out(phone):
+        return 'Opted out'
+    if not frequency_cap_allows(phone, message_type):
+        return 'Frequency cap reached'
+    return None
+
+# =============================================
+# RATE LIMITING
+# =============================================
+# Sending too fast gets the WhatsApp account flagged. Every send takes a
+# token from each bucket below (capacity, refill period in seconds); when
+# a bucket is empty the sender waits for it to refill. Bucket state is
+# saved in logs/ so hourly/daily caps hold across restarts and between
+# the CLI app and the send worker.
+SEND_LIMITS = {
+    'minute': (6, 60),
+    'hour': (120, 60 * 60),
+    'day': (800, 24 * 60 * 60),
+}
+SEND_JITTER_SECONDS = 3  # random extra gap so sends don't look scripted
+RATE_LIMIT_STATE = os.path.join(LOG_DIR, 'send_rate_limit.json')
+
+class SendRateLimiter:
+    """Token-bucket pacing for outgoing messages"""
+    
+    def __init__(self, limits=None, jitter_seconds=SEND_JITTER_SECONDS, state_file=RATE_LIMIT_STATE):
+        self.limits = dict(SEND_LIMITS if limits is None else limits)
+        self.jitter_seconds = jitter_seconds
+        self.state_file = state_file
+    
+    def _locked(self):
+        """Several processes may share one state file; take turns updating it"""
+        return file_lock(self.state_file) if self.state_file else nullcontext()
+    
+    def _load(self, now):
+        state = {}
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except json.JSONDecodeError:
+                state = {}
+        buckets = state.get('buckets', {})
+        for name, (capacity, period) in self.limits.items():
+            b = buckets.setdefault(name, {'tokens': capacity, 'updated': now})
+            refill = (now - b['updated']) * capacity / period
+            b['tokens'] = min(capacity, b['tokens'] + max(refill, 0))
+            b['updated'] = now
+        state['buckets'] = buckets
+        state.setdefault('last_send', 0)
+        return state
+    
+    def _save(self, state):
+        if not self.state_file:
+            return
+        tmp = f'{self.state_file}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+    
+    def wait_time(self, state, now, min_gap=0):
+        """Seconds until a send is allowed (0 if it can go now)"""
+        wait = max(0, state['last_send'] + min_gap - now)
+        for name, (capacity, period) in self.limits.items():
+            missing = 1 - state['buckets'][name]['tokens']
+            if missing > 0:
+                wait = max(wait, missing * period / capacity)
+        return wait
+    
+    def acquire(self, min_gap=0):
+        """
+        Block until the next message may be sent, then take a token.
+        
+        min_gap is measured from the start of the previous send, so time
+        spent sending counts towards it. Returns seconds waited.
+        """
+        gap = min_gap + random.uniform(0, self.jitter_seconds) if min_gap else 0
+        waited = 0
+        while True:
+            with self._locked():
+                now = time.time()
+                state = self._load(now)
+                wait = self.wait_time(state, now, gap)
+                if wait <= 0:
+                    for b in state['buckets'].values():
+                        b['tokens'] -= 1
+                    state['last_send'] = now
+                    self._save(state)
+                    return waited
+            if wait > 60:
+                print(f"  ⏳ Send limit reached, waiting {wait / 60:.0f} min...")
+                logging.info(f"Rate limit: waiting {wait:.0f}s before next send")
+            time.sleep(wait)
+            waited += wait
+    
+    def remaining(self):
+        """Messages left in each bucket right now"""
+        state = self._load(time.time())
+        return {name: int(b['tokens']) for name, b in state['buckets'].items()}
+
+_rate_limiter = None
+
+def get_rate_limiter():
+    """Shared limiter used by the bulk senders"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = SendRateLimiter()
+    return _rate_limiter
+
+def set_rate_limiter(limiter):
+    """Replace the shared limiter (e.g. with a sender account's own limits)"""
+    global _rate_limiter
+    _rate_limiter = limiter
+
+def _check_transport():
+    """Check if the message transport can send"""
+    return get_transport().check()
 
 def send_whatsapp_message(phone, message, wait_time=15):
     """
@@ -63,9 +754,14 @@ def send_whatsapp_message(phone, message, wait_time=15):
     Returns:
         (success: bool, message: str)
     """
-    ok, err = _check_pywhatkit()
+    ok, err = _check_transport()
     if not ok:
         return False, err
+    if is_opted_out(phone):
+        record_send_metric('suppressed')
+        return False, "Customer has opted out of messages"
+    transport = get_transport()
+    started = time.time()
     try:
         phone = str(phone).strip()
         if not phone.startswith('+'):
@@ -81,14 +777,11 @@ def send_whatsapp_message(phone, message, wait_time=15):
         
         logging.info(f"Sending message to {phone}")
         
-        kit.sendwhatmsg(
-            phone_no=phone,
-            message=message,
-            time_hour=hour,
-            time_min=minute,
-            wait_time=wait_time,
-            tab_close=True
-        )
+        if transport.schedules:
+            transport.send_text_at(phone, message, hour, minute, wait_time=wait_time)
+        else:
+            transport.send_text(phone, message, wait_time=wait_time)
+        _record_attempt(transport, {}, 'sent', 1, started)
         
         # Log success
         log_entry = {
@@ -104,6 +797,7 @@ def send_whatsapp_message(phone, message, wait_time=15):
         return True, "Message sent successfully!"
         
     except Exception as e:
+        _record_attempt(transport, {}, 'failed', 1, started, e, is_permanent_error(e))
         logging.error(f"Failed to send message to {phone}: {str(e)}")
         log_entry = {
             'phone': phone,
@@ -116,78 +810,255 @@ def send_whatsapp_message(phone, message, wait_time=15):
         save_message_log(log_entry)
         return False, f"Failed: {str(e)}"
 
-def send_whatsapp_message_instantly(phone, message):
+def is_permanent_error(error):
+    """True if retrying a failed send can't help (bad number, rejected message)"""
+    if getattr(error, 'permanent', False):
+        return True
+    # pywhatkit raises CountryCodeException for malformed numbers
+    return isinstance(error, ValueError) or type(error).__name__ == 'CountryCodeException'
+
+def send_batch_size():
+    """How many messages the transport sends at once (1 = one after another)"""
+    transport = get_transport()
+    if not hasattr(transport, 'send_texts'):
+        return 1
+    return max(1, getattr(transport, 'max_in_flight', 1))
+
+def _record_attempt(transport, metrics, outcome, attempt, started, error=None, permanent=False, seconds=None):
+    """Record one send attempt in the send metrics"""
+    record_send_metric(
+        outcome, campaign=metrics.get('campaign'), transport=transport.name,
+        error_class=type(error).__name__ if error else '', permanent=permanent, attempt=attempt,
+        queue_ms=metrics.get('queue_ms', 0) if attempt == 1 else 0,
+        render_ms=metrics.get('render_ms', 0) if attempt == 1 else 0,
+        transport_ms=(time.time() - started if seconds is None else seconds) * 1000,
+    )
+
+def _log_sent(phone, message, attempt):
+    log_entry = {
+        'phone': phone,
+        'message_preview': message[:100],
+        'status': 'sent',
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'type': 'instant'
+    }
+    if attempt > 1:
+        log_entry['attempts'] = attempt
+    save_message_log(log_entry)
+
+def _wait_before_retry(attempt, limiter=None):
+    """Back off after failed attempt n, then wait for the rate limiter"""
+    backoff = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+    time.sleep(backoff + random.uniform(0, RETRY_BACKOFF_SECONDS))
+    if limiter:
+        limiter.acquire()
+
+def _send_text(phone, message, retries=0, limiter=None, metrics=None, start_attempt=1):
     """
-    Send a WhatsApp message instantly (faster method).
-    Uses pywhatkit's instant send feature.
+    Send one text message, retrying transient failures with exponential
+    backoff (RETRY_BACKOFF_SECONDS, doubled per attempt, plus jitter).
+    Every attempt is recorded in the send metrics; `metrics` can add
+    campaign, queue_ms and render_ms. start_attempt > 1
+    continues the retries of a send that already failed (see _send_batch).
+    
+    Returns:
+        dict: status ('sent'/'failed'/'suppressed' if opted out), message, attempts, permanent
     """
-    ok, err = _check_pywhatkit()
+    metrics = metrics or {}
+    transport = get_transport()
+    ok, err = _check_transport()
     if not ok:
-        return False, err
-    try:
-        phone = str(phone).strip()
-        if not phone.startswith('+'):
-            phone = '+91' + phone.lstrip('0')
-        
-        kit.sendwhatmsg_instantly(
-            phone_no=phone,
-            message=message,
-            wait_time=12,
-            tab_close=True
-        )
-        
-        log_entry = {
-            'phone': phone,
-            'message_preview': message[:100],
-            'status': 'sent',
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'type': 'instant'
-        }
-        save_message_log(log_entry)
+        _record_attempt(transport, metrics, 'failed', 0, time.time(), RuntimeError(err))
+        return {'status': 'failed', 'message': err, 'attempts': 0, 'permanent': False}
+    phone = _normalize_phone(phone)
+    if is_opted_out(phone):
+        record_send_metric('suppressed', campaign=metrics.get('campaign'))
+        return {'status': 'suppressed', 'message': "Customer has opted out of messages",
+                'attempts': 0, 'permanent': False}
+    for attempt in range(start_attempt, retries + 2):
+        started = time.time()
+        try:
+            transport.send_text(phone, message, wait_time=12)
+        except Exception as e:
+            permanent = is_permanent_error(e)
+            logging.error(f"Send failed to {phone} (attempt {attempt}): {str(e)}")
+            if permanent or attempt > retries:
+                _record_attempt(transport, metrics, 'failed', attempt, started, e, permanent)
+                return {'status': 'failed', 'message': f"Failed: {str(e)}",
+                        'attempts': attempt, 'permanent': permanent}
+            _record_attempt(transport, metrics, 'retry', attempt, started, e)
+            _wait_before_retry(attempt, limiter)
+            continue
         
-        return True, "Message sent!"
-    except Exception as e:
-        logging.error(f"Instant send failed to {phone}: {str(e)}")
-        return False, f"Failed: {str(e)}"
+        _record_attempt(transport, metrics, 'sent', attempt, started)
+        _log_sent(phone, message, attempt)
+        return {'status': 'sent', 'message': "Message sent!", 'attempts': attempt, 'permanent': False}
 
-def send_bulk_messages(phone_list, message, delay_seconds=10):
+def _send_batch(batch, retries=0, limiter=None):
     """
-    Send same message to multiple customers.
+    Send [(phone, message, metrics), ...] together through the transport's
+    send_texts. Transient failures are then retried one by one, as
+    _send_text does. Returns one outcome dict per message, in order.
+    """
+    transport = get_transport()
+    ok, err = _check_transport()
+    if not ok:
+        for _, _, metrics in batch:
+            _record_attempt(transport, metrics, 'failed', 0, time.time(), RuntimeError(err))
+        return [{'status': 'failed', 'message': err, 'attempts': 0, 'permanent': False} for _ in batch]
     
-    Args:
-        phone_list: List of phone numbers
-        message: Message to send to all
-        delay_seconds: Delay between each message (to avoid spam detection)
+    outcomes = [None] * len(batch)
+    sending = []
+    for n, (phone, message, metrics) in enumerate(batch):
+        if is_opted_out(phone):
+            record_send_metric('suppressed', campaign=metrics.get('campaign'))
+            outcomes[n] = {'status': 'suppressed', 'message': "Customer has opted out of messages",
+                           'attempts': 0, 'permanent': False}
+        else:
+            sending.append(n)
+    started = time.time()
+    sent = transport.send_texts([(_normalize_phone(batch[n][0]), batch[n][1]) for n in sending])
+    for n, (phone, _, error, seconds) in zip(sending, sent):
+        message, metrics = batch[n][1], batch[n][2]
+        if error is None:
+            _record_attempt(transport, metrics, 'sent', 1, started, seconds=seconds)
+            _log_sent(phone, message, 1)
+            outcomes[n] = {'status': 'sent', 'message': "Message sent!", 'attempts': 1, 'permanent': False}
+            continue
+        permanent = is_permanent_error(error)
+        logging.error(f"Send failed to {phone} (attempt 1): {str(error)}")
+        if permanent or not retries:
+            _record_attempt(transport, metrics, 'failed', 1, started, error, permanent, seconds)
+            outcomes[n] = {'status': 'failed', 'message': f"Failed: {str(error)}",
+                           'attempts': 1, 'permanent': permanent}
+            continue
+        _record_attempt(transport, metrics, 'retry', 1, started, error, seconds=seconds)
+        _wait_before_retry(1, limiter)
+        outcomes[n] = _send_text(phone, message, retries, limiter, metrics, start_attempt=2)
+    return outcomes
+
+def send_whatsapp_message_instantly(phone, message):
+    """
+    Send a WhatsApp message instantly (faster method).
+    Uses pywhatkit's instant send feature.
+    """
+    outcome = _send_text(phone, message)
+    return outcome['status'] == 'sent', outcome['message']
+
+def _send_messages(messages, describe, delay_seconds, on_progress, limiter, message_type, retries,
+                   campaign, queue_ms):
+    """
+    The send loop shared by send_bulk_messages and send_personalized_messages.
     
-    Returns:
-        dict with success/failure counts
+    `messages` yields (phone, text or render callable). If the transport
+    can send batches (send_batch_size() > 1), up to that many messages go
+    out together; delay_seconds then separates batches. Results are still
+    reported to on_progress one by one, in input order. If on_progress
+    raises, the rest of the batch (already sent) is reported first.
     """
     results = {
-        'total': len(phone_list),
+        'total': 0,
         'sent': 0,
         'failed': 0,
+        'suppressed': 0,
         'details': []
     }
+    limiter = limiter or get_rate_limiter()
+    load_contact_index()
+    batch_size = send_batch_size()
+    batch = []  # in input order: suppression details and (phone, message, metrics) to send
     
-    for i, phone in enumerate(phone_list):
-        print(f"  Sending {i+1}/{len(phone_list)} to {phone}...")
-        success, msg = send_whatsapp_message_instantly(phone, message)
-        
-        if success:
-            results['sent'] += 1
+    def flush():
+        sending = [item for item in batch if isinstance(item, tuple)]
+        if len(sending) > 1:
+            outcomes = iter(_send_batch(sending, retries, limiter))
         else:
-            results['failed'] += 1
-        
-        results['details'].append({
-            'phone': phone,
-            'status': 'sent' if success else 'failed',
-            'message': msg
-        })
-        
-        # Delay between messages to avoid being flagged
-        if i < len(phone_list) - 1:
-            print(f"  Waiting {delay_seconds} seconds before next message...")
-            time.sleep(delay_seconds)
+            outcomes = iter(_send_text(phone, message, retries, limiter, metrics)
+                            for phone, message, metrics in sending)
+        error = None
+        for item in batch:
+            detail = item
+            if isinstance(item, tuple):
+                phone, message, _ = item
+                outcome = next(outcomes)
+                if outcome['status'] == 'sent':
+                    results['sent'] += 1
+                elif outcome['status'] == 'suppressed':
+                    results['suppressed'] += 1  # opted out while waiting for the rate limiter
+                else:
+                    results['failed'] += 1
+                    add_dead_letter(phone, message, message_type, outcome)
+                detail = {
+                    'phone': phone,
+                    'status': outcome['status'],
+                    'message': outcome['message'],
+                    'permanent': outcome['permanent']
+                }
+            results['details'].append(detail)
+            if on_progress:
+                try:
+                    on_progress(detail)
+                except Exception as e:
+                    error = error or e
+        batch.clear()
+        if error:
+            raise error
+    
+    for i, (phone, message) in enumerate(messages):
+        results['total'] += 1
+        if any(isinstance(item, tuple) and _normalize_phone(item[0]) == _normalize_phone(phone)
+               for item in batch):
+            flush()  # same phone twice: the cap has to see the first send
+        reason = _suppression_reason(phone, message_type)
+        if reason:
+            results['suppressed'] += 1
+            record_send_metric('suppressed', campaign=campaign)
+            batch.append({'phone': phone, 'status': 'suppressed', 'message': reason})
+        else:
+            # The gap counts from the limiter's last send, even one from an
+            # earlier run of the job, so a fresh account still starts at once
+            batch_started = not any(isinstance(item, tuple) for item in batch)
+            limiter.acquire(delay_seconds if batch_started else 0)
+            
+            render_started = time.time()
+            if callable(message):
+                message = message()
+            render_ms = (time.time() - render_started) * 1000
+            print(describe(i, phone))
+            batch.append((phone, message, {'campaign': campaign, 'queue_ms': queue_ms,
+                                           'render_ms': render_ms}))
+        if sum(1 for item in batch if isinstance(item, tuple)) >= batch_size or batch_size == 1:
+            flush()
+    flush()
+    return results
+
+def send_bulk_messages(phone_list, message, delay_seconds=10, on_progress=None, limiter=None,
+                       message_type='general', retries=SEND_RETRIES, campaign=None, queue_ms=0):
+    """
+    Send same message to multiple customers.
+    
+    Args:
+        phone_list: List of phone numbers
+        message: Message to send to all
+        delay_seconds: Minimum gap between message starts (to avoid spam
+            detection); between batches if the transport sends in batches
+        on_progress: Optional callback, called with each result detail dict
+        limiter: SendRateLimiter to pace sends (default: shared limiter)
+        message_type: Key of FREQUENCY_CAPS; customers over their cap (or
+            on the opt-out list) are skipped
+        retries: Extra attempts per message after a transient failure;
+            messages that still fail go to the dead-letter store
+        campaign, queue_ms: Campaign ID and how long the job waited to be
+            picked up (ms), for the send metrics
+    
+    Returns:
+        dict with success/failure/suppressed counts
+    """
+    results = _send_messages(
+        ((phone, message) for phone in phone_list),
+        lambda i, phone: f"  Sending {i+1}/{len(phone_list)} to {phone}...",
+        delay_seconds, on_progress, limiter, message_type, retries, campaign, queue_ms,
+    )
     
     # Log bulk send
     log_entry = {
@@ -195,6 +1066,8 @@ def send_bulk_messages(phone_list, message, delay_seconds=10):
         'total': results['total'],
         'sent': results['sent'],
         'failed': results['failed'],
+        'suppressed': results['suppressed'],
+        'message_type': message_type,
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'message_preview': message[:100]
     }
@@ -202,60 +1075,56 @@ def send_bulk_messages(phone_list, message, delay_seconds=10):
     
     return results
 
-def send_personalized_messages(customer_message_list, delay_seconds=10):
+def send_personalized_messages(customer_message_list, delay_seconds=10, on_progress=None, limiter=None,
+                               message_type='general', retries=SEND_RETRIES, campaign=None, queue_ms=0):
     """
     Send personalized messages to multiple customers.
     
     Args:
-        customer_message_list: List of tuples [(phone, personalized_message), ...]
-        delay_seconds: Delay between messages
+        customer_message_list: List (or any iterable/generator) of tuples
+            [(phone, personalized_message), ...]. It is consumed one item
+            at a time, and a message may be a zero-argument callable that
+            renders the text; it is only called once the recipient has
+            passed the frequency cap and the rate limiter.
+        delay_seconds: Minimum gap between message starts (between
+            batches if the transport sends in batches)
+        on_progress: Optional callback, called with each result detail dict
+        limiter: SendRateLimiter to pace sends (default: shared limiter)
+        message_type: Key of FREQUENCY_CAPS; customers over their cap (or
+            on the opt-out list) are skipped
+        retries: Extra attempts per message after a transient failure;
+            messages that still fail go to the dead-letter store
+        campaign, queue_ms: Campaign ID and how long the job waited to be
+            picked up (ms), for the send metrics
     
     Returns:
         dict with results
     """
-    results = {
-        'total': len(customer_message_list),
-        'sent': 0,
-        'failed': 0,
-        'details': []
-    }
-    
-    for i, (phone, message) in enumerate(customer_message_list):
-        print(f"  Sending personalized msg {i+1}/{len(customer_message_list)} to {phone}...")
-        success, msg = send_whatsapp_message_instantly(phone, message)
-        
-        if success:
-            results['sent'] += 1
-        else:
-            results['failed'] += 1
-        
-        results['details'].append({
-            'phone': phone,
-            'status': 'sent' if success else 'failed'
-        })
-        
-        if i < len(customer_message_list) - 1:
-            time.sleep(delay_seconds)
-    
-    return results
+    return _send_messages(
+        customer_message_list,
+        lambda i, phone: f"  Sending personalized msg {i+1} to {phone}...",
+        delay_seconds, on_progress, limiter, message_type, retries, campaign, queue_ms,
+    )
 
 def send_image_message(phone, image_path, caption=''):
-    """Send an image via WhatsApp"""
-    ok, err = _check_pywhatkit()
+    """Send an image via WhatsApp (resized once, then reused from the media cache)"""
+    ok, err = _check_transport()
     if not ok:
         return False, err
+    if is_opted_out(phone):
+        record_send_metric('suppressed')
+        return False, "Customer has opted out of messages"
+    transport = get_transport()
+    started = time.time()
     try:
         phone = str(phone).strip()
         if not phone.startswith('+'):
             phone = '+91' + phone.lstrip('0')
         
-        kit.sendwhats_image(
-            receiver=phone,
-            img_path=image_path,
-            caption=caption,
-            wait_time=15,
-            tab_close=True
-        )
+        image = prepare_image(image_path)
+        started = time.time()
+        transport.send_image(phone, image, caption, wait_time=15)
+        _record_attempt(transport, {}, 'sent', 1, started)
         
         log_entry = {
             'phone': phone,
@@ -268,30 +1137,82 @@ def send_image_message(phone, image_path, caption=''):
         
         return True, "Image sent!"
     except Exception as e:
+        _record_attempt(transport, {}, 'failed', 1, started, e, is_permanent_error(e))
         logging.error(f"Image send failed to {phone}: {str(e)}")
         return False, f"Failed: {str(e)}"
 
+# =============================================
+# MESSAGE STATS (running counters)
+# =============================================
+
+def _empty_message_stats():
+    return {'total': 0, 'by_status': {}, 'by_type': {}, 'by_day': {}}
+
+def _add_to_message_stats(stats, entries):
+    """Count log entries into the stats counters in place"""
+    for e in entries:
+        status = e.get('status') or 'unknown'
+        kind = e.get('type') or 'unknown'
+        day = stats['by_day'].setdefault(str(e.get('timestamp', ''))[:10], {'total': 0})
+        stats['total'] += 1
+        stats['by_status'][status] = stats['by_status'].get(status, 0) + 1
+        stats['by_type'][kind] = stats['by_type'].get(kind, 0) + 1
+        day['total'] += 1
+        day[status] = day.get(status, 0) + 1
+    return stats
+
+def save_message_stats(stats):
+    """Save the stats counters (atomic replace)"""
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    tmp = f'{MESSAGE_STATS}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False)
+    os.replace(tmp, MESSAGE_STATS)
+
+def _count_message_history():
+    return _add_to_message_stats(_empty_message_stats(), iter_message_history())
+
+def _read_message_stats():
+    """The saved counters, or None if missing or unreadable"""
+    try:
+        with open(MESSAGE_STATS, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def rebuild_message_stats():
+    """Recount the stats from the full message history (repair / first run)"""
+    with file_lock(MESSAGE_STATS):
+        stats = _count_message_history()
+        save_message_stats(stats)
+    return stats
+
+def load_message_stats():
+    """Load the stats counters (rebuilt from the history if missing)"""
+    stats = _read_message_stats()
+    return rebuild_message_stats() if stats is None else stats
+
+def update_message_stats(entries):
+    """Count newly logged entries (already appended to the history)"""
+    with file_lock(MESSAGE_STATS):
+        stats = _read_message_stats()
+        if stats is None:
+            stats = _count_message_history()  # the history already includes entries
+        else:
+            _add_to_message_stats(stats, entries)
+        save_message_stats(stats)
+
 def get_message_stats():
     """Get messaging statistics"""
-    history = load_message_history()
-    if not history:
-        return {
-            'total_messages': 0,
-            'sent': 0,
-            'failed': 0,
-            'today': 0
-        }
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    today_msgs = [h for h in history if h.get('timestamp', '').startswith(today)]
-    sent = len([h for h in history if h.get('status') == 'sent'])
-    failed = len([h for h in history if h.get('status') == 'failed'])
-    
+    ingest_pywhatkit_log()
+    stats = load_message_stats()
+    today = stats['by_day'].get(datetime.now().strftime('%Y-%m-%d'), {})
     return {
-        'total_messages': len(history),
-        'sent': sent,
-        'failed': failed,
-        'today': len(today_msgs)
+        'total_messages': stats['total'],
+        'sent': stats['by_status'].get('sent', 0),
+        'failed': stats['by_status'].get('failed', 0),
+        'today': today.get('total', 0),
+        'by_type': stats['by_type'],
     }
 
 def generate_whatsapp_link(phone, message):
@@ -300,3 +1221,42 @@ def generate_whatsapp_link(phone, message):
     phone = str(phone).strip().replace('+', '')
     encoded_msg = urllib.parse.quote(message)
     return f"https://wa.me/{phone}?text={encoded_msg}"
+
+def generate_whatsapp_links(customers, message):
+    """
+    Personalized click-to-chat links for a whole segment in one pass.
+    
+    Args:
+        customers: DataFrame with 'phone' and 'name' columns
+        message: Message text; {name} is replaced with each customer's name
+    
+    Returns:
+        DataFrame with phone, name, message and link columns (customers
+        on the opt-out list are left out)
+    """
+    import urllib.parse
+    import pandas as pd
+    
+    if customers.empty:
+        return pd.DataFrame(columns=['phone', 'name', 'message', 'link'])
+    customers = customers[~customers['phone'].map(is_opted_out)]
+    names = customers['name'].fillna('').astype(str)
+    digits = customers['phone'].astype(str).str.replace(r'\D', '', regex=True)
+    digits = digits.where(digits.str.len() != 10, '91' + digits)
+    
+    # Percent-encoding works character by character, so the template
+    # pieces are encoded once and only the (unique) names per row.
+    parts = message.split('{name}')
+    quoted_names = names.map({n: urllib.parse.quote(n) for n in names.unique()})
+    text = pd.Series(parts[0], index=customers.index)
+    encoded = pd.Series(urllib.parse.quote(parts[0]), index=customers.index)
+    for part in parts[1:]:
+        text = text + names + part
+        encoded = encoded + quoted_names + urllib.parse.quote(part)
+    
+    return pd.DataFrame({
+        'phone': customers['phone'].astype(str),
+        'name': names,
+        'message': text,
+        'link': 'https://wa.me/' + digits + '?text=' + encoded,
+    }).reset_index(drop=True)
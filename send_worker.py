@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# ============================================================
+# 🏪 BHURE ELECTRICAL - Background Send Worker
+# ============================================================
+# Sends the WhatsApp jobs queued by the web dashboard.
+# Run it next to web_app.py (same machine, WhatsApp Web logged in):
+#
+#   python send_worker.py                  # keep running, poll for jobs
+#   python send_worker.py --once           # drain the queue and exit
+#   python send_worker.py --account NAME   # worker for one sender account
+#
+# With two or more accounts in data/sender_accounts.json the worker
+# starts one process per account and splits big campaigns between them.
+# Scheduled campaigns are released when they are due (outside quiet hours).
+# ============================================================
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from modules.send_queue import run_worker, run_pool
+
+if __name__ == '__main__':
+    print("\n  🏪 Bhure Electrical - Send Worker")
+    print(f"  {'─' * 40}")
+    print("  Waiting for queued messages... (Ctrl+C to stop)\n")
+    try:
+        if '--account' in sys.argv:
+            run_worker(once='--once' in sys.argv, account=sys.argv[sys.argv.index('--account') + 1])
+        elif '--once' in sys.argv:
+            run_worker(once=True)
+        else:
+            run_pool()
+    except KeyboardInterrupt:
+        print("\n  👋 Worker stopped.")
@@ -9,25 +9,33 @@
 import os
 import sys
 from datetime import datetime
+from urllib.parse import urlencode
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for
+from flask import Flask, render_template_string, request, jsonify, redirect, url_for, Response
 from modules.customer_db import (
     add_customer, load_customers, search_customers, get_customer_stats,
     get_recent_customers, get_top_customers, get_all_active_customers,
     record_purchase, get_customer_by_phone
 )
 from modules.whatsapp_sender import (
-    send_whatsapp_message_instantly, send_bulk_messages,
-    get_message_stats, generate_whatsapp_link
+    get_message_stats, generate_whatsapp_link, generate_whatsapp_links,
+    load_dead_letters, mark_dead_letters, load_opt_outs, add_opt_outs, remove_opt_outs
 )
+from modules.send_queue import (
+    enqueue_bulk, enqueue_personalized, enqueue_rendered, job_status, list_jobs,
+    scheduled_jobs, cancel_scheduled_job
+)
+from modules.send_metrics import get_send_metrics_summary
 from modules.festival_manager import (
-    get_today_festivals, get_upcoming_festivals, get_festival_message,
-    get_birthday_message
+    get_today_festivals, get_upcoming_festivals, get_birthday_message
+)
+from modules.new_arrivals import add_product, get_new_arrivals
+from modules.bill_manager import (
+    generate_purchase_thankyou, generate_feedback_request, generate_referral_message,
+    get_revenue_trends
 )
-from modules.new_arrivals import add_product, get_new_arrivals, generate_new_arrival_message
-from modules.bill_manager import generate_purchase_thankyou, generate_feedback_request, generate_referral_message
 from modules.message_templates import (
     welcome_message, energy_saving_tips, safety_tips_monsoon, review_request
 )
@@ -138,6 +146,11 @@ DASHBOARD_HTML = """
         .toast-error { background: #e74c3c; }
         @keyframes slideIn { from { transform: translateX(100%); } to { transform: translateX(0); } }
         
+        /* Revenue Trend Bars */
+        .trend-bars { display: flex; align-items: flex-end; gap: 3px; height: 120px; margin-top: 15px; }
+        .trend-bars .bar { flex: 1; background: #25d366; border-radius: 3px 3px 0 0; min-height: 2px; }
+        .trend-legend { display: flex; justify-content: space-between; color: #666; font-size: 12px; margin-top: 5px; }
+        
         /* Preview Box */
         .preview-box { background: #e5ddd5; border-radius: 12px; padding: 20px; margin-top: 15px; }
         .preview-message { background: #dcf8c6; border-radius: 8px; padding: 15px; max-width: 400px; white-space: pre-wrap; font-size: 14px; line-height: 1.5; box-shadow: 0 1px 2px rgba(0,0,0,0.1); }
@@ -200,6 +213,86 @@ DASHBOARD_HTML = """
                 </div>
             </div>
             
+            <!-- Revenue Trends -->
+            <div class="section">
+                <h2>📈 Revenue Trends</h2>
+                <div class="stats-grid">
+                    <div class="stat-card">
+                        <div class="number">₹{{ "{:,.0f}".format(trends.period_revenue) }}</div>
+                        <div class="label">Last 30 Days ({{ trends.period_bills }} bills)</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="number">₹{{ "{:,.0f}".format(trends.this_month) }}</div>
+                        <div class="label">This Month</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="number">{% if trends.mom_change_pct is none %}-{% else %}{{ "{:+.1f}".format(trends.mom_change_pct) }}%{% endif %}</div>
+                        <div class="label">vs Last Month (₹{{ "{:,.0f}".format(trends.last_month) }})</div>
+                    </div>
+                </div>
+                {% set peak = trends.daily|map(attribute='amount')|max %}
+                <div class="trend-bars">
+                    {% for d in trends.daily %}
+                    <div class="bar" title="{{ d.day }}: ₹{{ "{:,.0f}".format(d.amount) }} ({{ d.bills }} bills)" style="height:{{ (d.amount / peak * 100) if peak else 0 }}%;"></div>
+                    {% endfor %}
+                </div>
+                <div class="trend-legend"><span>{{ trends.daily[0].day }}</span><span>{{ trends.daily[-1].day }}</span></div>
+                {% if trends.by_category %}
+                <div style="margin-top:15px; display:flex; flex-wrap:wrap; gap:8px;">
+                    {% for category, amount in trends.by_category|dictsort(by='value', reverse=true) %}
+                    <span class="badge badge-green">{{ category }}: ₹{{ "{:,.0f}".format(amount) }}</span>
+                    {% endfor %}
+                    {% for mode, amount in trends.by_payment_mode|dictsort(by='value', reverse=true) %}
+                    <span class="badge badge-blue">{{ mode }}: ₹{{ "{:,.0f}".format(amount) }}</span>
+                    {% endfor %}
+                </div>
+                {% endif %}
+            </div>
+            
+            <!-- Send Performance -->
+            {% if send_perf.attempts %}
+            <div class="section">
+                <h2>⚡ Send Performance</h2>
+                <div class="stats-grid">
+                    <div class="stat-card">
+                        <div class="number">{{ send_perf.latency.transport_ms.p50 }} ms</div>
+                        <div class="label">Send Time p50 (p95 {{ send_perf.latency.transport_ms.p95 }} ms, p99 {{ send_perf.latency.transport_ms.p99 }} ms)</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="number">{{ "{:,.0f}".format(send_perf.latency.queue_ms.p50 / 1000) }} s</div>
+                        <div class="label">Time in Queue p50 (p95 {{ "{:,.0f}".format(send_perf.latency.queue_ms.p95 / 1000) }} s)</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="number">{{ send_perf.sent }} / {{ send_perf.attempts }}</div>
+                        <div class="label">Sent / Attempts (last {{ send_perf.days }} days)</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="number">{{ send_perf.failed }}</div>
+                        <div class="label">Failed{% for name, count in send_perf.errors.items() %} · {{ name }} ×{{ count }}{% endfor %}</div>
+                    </div>
+                </div>
+                {% if send_perf.campaigns %}
+                <div class="table-container">
+                    <table>
+                        <thead><tr><th>Campaign</th><th>Sent</th><th>Failed</th><th>Capped</th><th>Msgs/Hour</th><th>Last Send</th></tr></thead>
+                        <tbody>
+                            {% for c in send_perf.campaigns %}
+                            <tr>
+                                <td>{{ c.campaign }}</td>
+                                <td>{{ c.sent }}</td>
+                                <td>{{ c.failed }}</td>
+                                <td>{{ c.suppressed }}</td>
+                                <td>{{ c.per_hour }}</td>
+                                <td>{{ c.last }}</td>
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                </div>
+                {% endif %}
+            </div>
+            {% endif %}
+            
             <!-- Upcoming Events -->
             {% if upcoming_festivals %}
             <div class="section">
@@ -330,6 +423,12 @@ DASHBOARD_HTML = """
                 <div class="form-group" id="single_phone_group">
                     <label>Phone Number</label>
                     <input type="text" id="msg_phone" placeholder="+919876543210">
+                    <label style="margin-top:10px;">Priority</label>
+                    <select id="msg_lane">
+                        <option value="">General</option>
+                        <option value="transactional">Bill / Thank-you (sent first)</option>
+                        <option value="reminder">Payment Reminder (priority)</option>
+                    </select>
                 </div>
                 <div class="form-group" id="category_group" style="display:none;">
                     <label>Category</label>
@@ -341,9 +440,13 @@ DASHBOARD_HTML = """
                         <option>Contractor</option>
                     </select>
                 </div>
+                <div class="form-group">
+                    <label>Send At (leave empty to send now)</label>
+                    <input type="datetime-local" id="msg_send_at">
+                </div>
                 <div class="form-group">
                     <label>Message</label>
-                    <textarea id="msg_text" placeholder="Type your message here... Use * for bold in WhatsApp"></textarea>
+                    <textarea id="msg_text" placeholder="Type your message here... Use * for bold in WhatsApp, {name} for the customer's name"></textarea>
                 </div>
                 
                 <!-- Preview -->
@@ -360,6 +463,40 @@ DASHBOARD_HTML = """
                     <input type="text" id="waLinkInput" readonly style="width:100%; padding:10px; background:#f5f5f5; border:1px solid #ddd; border-radius:8px;">
                 </div>
             </div>
+            
+            <div class="section">
+                <h2>🚫 Opt-outs ({{ opt_out_count }})</h2>
+                <p style="color:#666; font-size:13px;">Customers on this list never get messages, from any campaign.</p>
+                <div class="form-group">
+                    <label>Phone Numbers (one per line or comma separated)</label>
+                    <textarea id="opt_out_phones" placeholder="+919876543210"></textarea>
+                </div>
+                <div style="display:flex; gap:10px;">
+                    <button class="btn btn-outline" onclick="updateOptOuts('add')">🚫 Opt Out</button>
+                    <button class="btn btn-outline" onclick="updateOptOuts('remove')">↩️ Remove from List</button>
+                </div>
+            </div>
+            
+            {% if scheduled %}
+            <div class="section">
+                <h2>⏰ Scheduled Messages</h2>
+                <div class="table-container">
+                    <table>
+                        <thead><tr><th>Send At</th><th>Campaign</th><th>Messages</th><th></th></tr></thead>
+                        <tbody>
+                            {% for job in scheduled %}
+                            <tr>
+                                <td>{{ job.send_at[:16] }}</td>
+                                <td>{{ job.description or job.kind }}</td>
+                                <td>{{ job.total }}</td>
+                                <td><button class="btn btn-outline btn-sm" onclick="cancelScheduled('{{ job.id }}')">✖ Cancel</button></td>
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                </div>
+            </div>
+            {% endif %}
         </div>
         
         <!-- ============ FESTIVALS TAB ============ -->
@@ -390,6 +527,9 @@ DASHBOARD_HTML = """
                         <div style="color:#666; font-size:13px;">{{ f.date }} &mdash; {{ f.days_until }} days from now</div>
                     </div>
                     <span class="badge badge-orange">{{ f.type }}</span>
+                    {% if f.days_until > 0 %}
+                    <button class="btn btn-outline btn-sm" onclick="sendFestivalWishes('{{ f.name }}', '{{ f.date }}T07:00')">⏰ Schedule 7 AM</button>
+                    {% endif %}
                 </div>
                 {% endfor %}
                 {% if not upcoming_30 %}
@@ -606,11 +746,13 @@ DASHBOARD_HTML = """
             
             if (!message) { showToast('Please enter a message!', 'error'); return; }
             
-            const data = { target, message };
-            if (target === 'single') data.phone = document.getElementById('msg_phone').value;
+            const data = { target, message, send_at: document.getElementById('msg_send_at').value };
+            if (target === 'single') {
+                data.phone = document.getElementById('msg_phone').value;
+                data.lane = document.getElementById('msg_lane').value;
+            }
             if (target === 'category') data.category = document.getElementById('msg_category').value;
             
-            showToast('📤 Sending messages...');
             const res = await fetch('/api/message/send', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
@@ -618,12 +760,37 @@ DASHBOARD_HTML = """
             });
             const result = await res.json();
             showToast(result.message, result.success ? 'success' : 'error');
+            if (result.job_id) watchJob(result.job_id);
+        }
+        
+        // Poll a queued send job until the worker finishes it
+        async function watchJob(jobId) {
+            const res = await fetch('/api/jobs/' + jobId);
+            const result = await res.json();
+            if (!result.success) return;
+            const job = result.job;
+            if (job.status === 'scheduled' || job.status === 'cancelled') return;
+            if (job.status === 'done' || job.status === 'failed') {
+                showToast(`Job ${job.status}: ✅ ${job.sent} sent, ❌ ${job.failed} failed, ⏸️ ${job.suppressed} capped`, job.status === 'done' ? 'success' : 'error');
+                return;
+            }
+            if (job.status === 'running') showToast(`📤 Sending... ${job.progress_pct}% (${job.sent + job.failed + job.suppressed}/${job.total})`);
+            setTimeout(() => watchJob(jobId), 5000);
         }
         
         // Generate WhatsApp Link
         function generateLink() {
+            const target = document.getElementById('msg_target').value;
             const phone = document.getElementById('msg_phone').value;
             const message = document.getElementById('msg_text').value;
+            if (target !== 'single') {
+                // Whole segment: open a page of click-to-chat links
+                if (!message) { showToast('Enter a message!', 'error'); return; }
+                const params = new URLSearchParams({ target, message,
+                    category: document.getElementById('msg_category').value });
+                window.open('/links?' + params.toString(), '_blank');
+                return;
+            }
             if (!phone || !message) { showToast('Enter phone and message!', 'error'); return; }
             
             const cleanPhone = phone.replace(/[^0-9]/g, '');
@@ -643,25 +810,49 @@ DASHBOARD_HTML = """
         }
         
         // Send Festival Wishes
-        async function sendFestivalWishes(festivalName) {
-            if (!confirm(`Send ${festivalName} wishes to ALL customers?`)) return;
-            showToast('🎉 Sending festival wishes...');
+        async function sendFestivalWishes(festivalName, sendAt) {
+            const when = sendAt ? ` on ${sendAt.replace('T', ' at ')}` : '';
+            if (!confirm(`Send ${festivalName} wishes to ALL customers${when}?`)) return;
             const res = await fetch('/api/festival/send', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({ festival: festivalName })
+                body: JSON.stringify({ festival: festivalName, send_at: sendAt })
             });
             const result = await res.json();
             showToast(result.message, result.success ? 'success' : 'error');
+            if (result.job_id) watchJob(result.job_id);
+        }
+        
+        // Add phones to / remove them from the opt-out list
+        async function updateOptOuts(action) {
+            const phones = document.getElementById('opt_out_phones').value.split(/[\n,]/).map(p => p.trim()).filter(p => p);
+            if (!phones.length) { showToast('Enter phone numbers!', 'error'); return; }
+            const res = await fetch('/api/opt-outs', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ action, phones })
+            });
+            const result = await res.json();
+            showToast(result.message, result.success ? 'success' : 'error');
+            if (result.success) location.reload();
+        }
+        
+        // Cancel a scheduled campaign
+        async function cancelScheduled(jobId) {
+            if (!confirm('Cancel this scheduled campaign?')) return;
+            const res = await fetch(`/api/scheduled/${jobId}/cancel`, { method: 'POST' });
+            const result = await res.json();
+            showToast(result.message, result.success ? 'success' : 'error');
+            if (result.success) location.reload();
         }
         
         // Send New Arrivals
         async function sendNewArrivals() {
             if (!confirm('Announce new arrivals to ALL customers?')) return;
-            showToast('📤 Sending new arrival announcements...');
             const res = await fetch('/api/arrivals/send', { method: 'POST' });
             const result = await res.json();
             showToast(result.message, result.success ? 'success' : 'error');
+            if (result.job_id) watchJob(result.job_id);
         }
         
         // Template Loading
@@ -718,6 +909,67 @@ DASHBOARD_HTML = """
 # =============================================
 # ROUTES
 # =============================================
+LINKS_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ shop_name }} - WhatsApp Links</title>
+    <style>
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f0f2f5; color: #333; }
+        .header { background: linear-gradient(135deg, #075e54, #128c7e); color: white; padding: 20px 30px; }
+        .header h1 { font-size: 22px; }
+        .header p { font-size: 14px; opacity: 0.9; margin-top: 4px; }
+        .container { max-width: 1000px; margin: 20px auto; padding: 0 20px; }
+        .section { background: white; border-radius: 12px; padding: 20px; box-shadow: 0 2px 8px rgba(0,0,0,0.08); }
+        table { width: 100%; border-collapse: collapse; }
+        th, td { padding: 10px; text-align: left; border-bottom: 1px solid #eee; font-size: 14px; }
+        th { background: #f8f9fa; color: #075e54; }
+        tr.done td { opacity: 0.45; }
+        .btn { display: inline-block; padding: 7px 14px; border-radius: 8px; text-decoration: none; font-size: 13px; background: #25d366; color: white; }
+        .btn-outline { background: white; color: #075e54; border: 1px solid #075e54; }
+        .pager { display: flex; justify-content: space-between; align-items: center; margin-top: 15px; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>🔗 WhatsApp Links - {{ segment }}</h1>
+        <p>{{ total }} customers · page {{ page }} of {{ pages }} · clicked links are greyed out</p>
+    </div>
+    <div class="container">
+        <div class="section">
+            <div style="margin-bottom:15px;"><a class="btn btn-outline" href="/links.csv?{{ query }}">⬇️ Download CSV</a></div>
+            <table>
+                <tr><th>#</th><th>Name</th><th>Phone</th><th></th></tr>
+                {% for row in rows %}
+                <tr id="row-{{ row.phone }}">
+                    <td>{{ start + loop.index }}</td>
+                    <td>{{ row.name }}</td>
+                    <td>{{ row.phone }}</td>
+                    <td><a class="btn" href="{{ row.link }}" target="_blank" onclick="markDone('{{ row.phone }}')">💬 Open WhatsApp</a></td>
+                </tr>
+                {% endfor %}
+            </table>
+            <div class="pager">
+                {% if page > 1 %}<a class="btn btn-outline" href="/links?{{ query }}&page={{ page - 1 }}">⬅️ Previous</a>{% else %}<span></span>{% endif %}
+                {% if page < pages %}<a class="btn btn-outline" href="/links?{{ query }}&page={{ page + 1 }}">Next ➡️</a>{% endif %}
+            </div>
+        </div>
+    </div>
+    <script>
+        // Remember clicked links (per message) so staff can see where they left off
+        const key = 'wa-links-' + {{ message_key | tojson }};
+        const done = new Set(JSON.parse(localStorage.getItem(key) || '[]'));
+        function paint() { done.forEach(p => { const r = document.getElementById('row-' + p); if (r) r.className = 'done'; }); }
+        function markDone(phone) { done.add(phone); localStorage.setItem(key, JSON.stringify([...done])); paint(); }
+        paint();
+    </script>
+</body>
+</html>
+"""
+
 @app.route('/')
 def index():
     customers = load_customers()
@@ -727,6 +979,10 @@ def index():
     upcoming = get_upcoming_festivals(7)
     upcoming_30 = get_upcoming_festivals(30)
     new_arrivals = get_new_arrivals(10)
+    trends = get_revenue_trends(30)
+    send_perf = get_send_metrics_summary(7)
+    scheduled = scheduled_jobs()
+    opt_out_count = len(load_opt_outs())
     
     return render_template_string(DASHBOARD_HTML,
         shop_name=SHOP_NAME,
@@ -737,7 +993,11 @@ def index():
         today_festivals=today_festivals,
         upcoming_festivals=upcoming,
         upcoming_30=upcoming_30,
-        new_arrivals=new_arrivals
+        new_arrivals=new_arrivals,
+        trends=trends,
+        send_perf=send_perf,
+        scheduled=scheduled,
+        opt_out_count=opt_out_count
     )
 
 @app.route('/api/customer/add', methods=['POST'])
@@ -790,6 +1050,26 @@ def api_add_product():
     )
     return jsonify({'success': success, 'message': message})
 
+def _send_at(data):
+    """Optional send time from a request ('YYYY-MM-DDTHH:MM' as sent by datetime-local inputs)"""
+    value = (data or {}).get('send_at')
+    if not value:
+        return None
+    send_at = datetime.fromisoformat(value)
+    if send_at <= datetime.now():
+        raise ValueError('Send time must be in the future')
+    return send_at
+
+def _queued_response(job_id, total, what):
+    send_at = job_status(job_id)['send_at']
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'send_at': send_at,
+        'message': f"⏰ {what}: {total} message(s) scheduled for {send_at[:16]} (job {job_id})" if send_at
+                   else f"📤 {what}: {total} message(s) queued (job {job_id})"
+    })
+
 @app.route('/api/message/send', methods=['POST'])
 def api_send_message():
     data = request.json
@@ -800,6 +1080,10 @@ def api_send_message():
     msg_valid, msg_result = Validator.message_text(message)
     if not msg_valid:
         return jsonify({'success': False, 'message': f'Message error: {msg_result}'})
+    try:
+        send_at = _send_at(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Send time error: {str(e)}'})
     
     if target == 'single':
         phone = data.get('phone', '')
@@ -807,15 +1091,22 @@ def api_send_message():
         phone_valid, phone_result = Validator.phone(phone)
         if not phone_valid:
             return jsonify({'success': False, 'message': f'Phone error: {phone_result}'})
-        success, msg = send_whatsapp_message_instantly(phone_result, message)
-        return jsonify({'success': success, 'message': msg})
+        # Only one-to-one messages may use the priority lanes; broadcasts stay marketing.
+        # Free text stays 'individual' either way, so it never skips caps or quiet hours.
+        lane = data.get('lane') or None
+        if lane not in (None, 'transactional', 'reminder'):
+            return jsonify({'success': False, 'message': f'Unknown priority: {lane}'})
+        job_id = enqueue_bulk([phone_result], message, description=f'Message to {phone_result}',
+                              message_type='individual', send_at=send_at, lane=lane)
+        return _queued_response(job_id, 1, 'Message')
     
     elif target == 'all':
         customers = get_all_active_customers()
         if customers.empty:
             return jsonify({'success': False, 'message': 'No customers!'})
-        results = send_bulk_messages(customers['phone'].tolist(), message)
-        return jsonify({'success': True, 'message': f"Sent: {results['sent']}, Failed: {results['failed']}"})
+        job_id = enqueue_bulk(customers['phone'].tolist(), message, description='Broadcast to all customers',
+                              send_at=send_at)
+        return _queued_response(job_id, len(customers), 'Broadcast')
     
     elif target == 'category':
         category = data.get('category', 'General')
@@ -823,15 +1114,17 @@ def api_send_message():
         filtered = customers[customers['category'] == category]
         if filtered.empty:
             return jsonify({'success': False, 'message': f'No customers in {category}!'})
-        results = send_bulk_messages(filtered['phone'].tolist(), message)
-        return jsonify({'success': True, 'message': f"Sent: {results['sent']}, Failed: {results['failed']}"})
+        job_id = enqueue_bulk(filtered['phone'].tolist(), message, description=f'Broadcast to {category}',
+                              send_at=send_at)
+        return _queued_response(job_id, len(filtered), 'Broadcast')
     
     elif target == 'recent':
         recent = get_recent_customers(30)
         if recent.empty:
             return jsonify({'success': False, 'message': 'No recent customers!'})
-        results = send_bulk_messages(recent['phone'].tolist(), message)
-        return jsonify({'success': True, 'message': f"Sent: {results['sent']}, Failed: {results['failed']}"})
+        job_id = enqueue_bulk(recent['phone'].tolist(), message, description='Broadcast to recent customers',
+                              send_at=send_at)
+        return _queued_response(job_id, len(recent), 'Broadcast')
     
     return jsonify({'success': False, 'message': 'Invalid target'})
 
@@ -845,16 +1138,11 @@ def api_send_festival():
         if customers.empty:
             return jsonify({'success': False, 'message': 'No customers!'})
         
-        messages = []
-        for _, c in customers.iterrows():
-            msg = get_festival_message(festival_name, c['name'], SHOP_NAME)
-            messages.append((c['phone'], msg))
-        
-        results = send_personalized_messages(messages)
-        return jsonify({
-            'success': True, 
-            'message': f"🎉 Festival wishes sent! ✅ {results['sent']} sent, ❌ {results['failed']} failed"
-        })
+        job_id = enqueue_rendered(zip(customers['phone'], customers['name']), 'festival',
+                                  {'festival': festival_name, 'shop_name': SHOP_NAME},
+                                  description=f'{festival_name} wishes', message_type='festival',
+                                  send_at=_send_at(data))
+        return _queued_response(job_id, len(customers), '🎉 Festival wishes')
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
@@ -868,17 +1156,122 @@ def api_send_arrivals():
     if not arrivals:
         return jsonify({'success': False, 'message': 'No new arrivals!'})
     
-    messages = []
-    for _, c in customers.iterrows():
-        msg = generate_new_arrival_message(arrivals, c['name'], SHOP_NAME)
-        messages.append((c['phone'], msg))
-    
-    from modules.whatsapp_sender import send_personalized_messages
-    results = send_personalized_messages(messages)
-    return jsonify({
-        'success': True,
-        'message': f"📤 Announcements sent! ✅ {results['sent']} sent, ❌ {results['failed']} failed"
-    })
+    job_id = enqueue_rendered(zip(customers['phone'], customers['name']), 'arrivals',
+                              {'arrivals': arrivals, 'shop_name': SHOP_NAME},
+                              description='New arrivals announcement', message_type='arrivals')
+    return _queued_response(job_id, len(customers), 'Announcements')
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    job = job_status(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs')
+def api_list_jobs():
+    return jsonify({'success': True, 'jobs': list_jobs(max(request.args.get('limit', 20, type=int), 1))})
+
+@app.route('/api/opt-outs')
+def api_opt_outs():
+    opt_outs = load_opt_outs()
+    return jsonify({'success': True, 'count': len(opt_outs),
+                    'opt_outs': [dict(phone=phone, **info) for phone, info in sorted(opt_outs.items())]})
+
+@app.route('/api/opt-outs', methods=['POST'])
+def api_update_opt_outs():
+    data = request.json or {}
+    phones = data.get('phones', [])
+    if not isinstance(phones, list):
+        return jsonify({'success': False, 'message': 'phones must be a list of phone numbers'})
+    if data.get('action') == 'remove':
+        return jsonify({'success': True, 'message': f'{remove_opt_outs(phones)} phone(s) removed from the opt-out list'})
+    if data.get('action') == 'add':
+        return jsonify({'success': True, 'message': f"{add_opt_outs(phones, data.get('reason', ''))} phone(s) opted out"})
+    return jsonify({'success': False, 'message': 'Invalid action'})
+
+@app.route('/api/scheduled')
+def api_scheduled_jobs():
+    return jsonify({'success': True, 'jobs': scheduled_jobs()})
+
+@app.route('/api/scheduled/<job_id>/cancel', methods=['POST'])
+def api_cancel_scheduled(job_id):
+    if not cancel_scheduled_job(job_id):
+        return jsonify({'success': False, 'message': 'Job is not scheduled (already sent or cancelled)'}), 404
+    return jsonify({'success': True, 'message': f'Cancelled job {job_id}'})
+
+LINKS_PER_PAGE = 50
+
+def _segment_customers(target, category='General'):
+    """Customers for a send target: all / category / recent; (label, DataFrame)"""
+    if target == 'category':
+        customers = load_customers()
+        return f'{category} customers', customers[customers['category'] == category]
+    if target == 'recent':
+        return 'Recent customers (30 days)', get_recent_customers(30)
+    return 'All customers', get_all_active_customers()
+
+def _segment_links():
+    args = request.args
+    segment, customers = _segment_customers(args.get('target', 'all'), args.get('category', 'General'))
+    return segment, generate_whatsapp_links(customers, args.get('message', ''))
+
+@app.route('/links')
+def whatsapp_links_page():
+    segment, links = _segment_links()
+    page = max(request.args.get('page', 1, type=int), 1)
+    pages = max((len(links) + LINKS_PER_PAGE - 1) // LINKS_PER_PAGE, 1)
+    start = (page - 1) * LINKS_PER_PAGE
+    query = urlencode({k: v for k, v in request.args.items() if k != 'page'})
+    return render_template_string(LINKS_HTML,
+        shop_name=SHOP_NAME,
+        segment=segment,
+        total=len(links),
+        page=page,
+        pages=pages,
+        start=start,
+        rows=links.iloc[start:start + LINKS_PER_PAGE].to_dict('records') if len(links) else [],
+        query=query,
+        message_key=request.args.get('message', '')[:50],
+    )
+
+@app.route('/links.csv')
+def whatsapp_links_csv():
+    _, links = _segment_links()
+    return Response(links.to_csv(index=False), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=whatsapp_links.csv'})
+
+@app.route('/api/dead-letters')
+def api_dead_letters():
+    return jsonify({'success': True, 'dead_letters': load_dead_letters()})
+
+def _resend_queued(entry):
+    """True if a resend job for this dead letter is still waiting or running"""
+    job = job_status(entry['job']) if entry.get('job') else None
+    return bool(job) and job['status'] in ('queued', 'running', 'scheduled')
+
+@app.route('/api/dead-letters/replay', methods=['POST'])
+def api_replay_dead_letters():
+    ids = (request.json or {}).get('ids')  # None = all
+    wanted = None if ids is None else set(ids)
+    by_type = {}
+    for e in load_dead_letters():
+        if (wanted is None or e['id'] in wanted) and not _resend_queued(e):
+            by_type.setdefault(e.get('message_type', 'general'), []).append(e)
+    if not by_type:
+        return jsonify({'success': False, 'message': 'No failed messages to resend'})
+    # The entries stay in the store until their resend is sent (see run_job)
+    job_ids = []
+    for message_type, entries in by_type.items():
+        letter_ids = [e['id'] for e in entries]
+        job_id = enqueue_personalized([(e['phone'], e['message']) for e in entries],
+                                      description=f'Resend failed {message_type} messages',
+                                      message_type=message_type, dead_letters=letter_ids)
+        mark_dead_letters(letter_ids, job=job_id)
+        job_ids.append(job_id)
+    total = sum(len(e) for e in by_type.values())
+    return jsonify({'success': True, 'job_ids': job_ids,
+                    'message': f"📤 Resend: {total} message(s) queued"})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))